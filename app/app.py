@@ -1,21 +1,50 @@
+import datetime
+import functools
+
 import dash
 import dash_bootstrap_components as dbc
-from dash import Input, Output, dcc, html
+from dash import Input, Output, State, dcc, html, no_update
 import pandas as pd
 import plotly.express as px
+from plotly.utils import PlotlyJSONEncoder
 from sqlalchemy.orm import scoped_session, sessionmaker
-from data.db import engine
+from data import metrics
+from data.db import read_engine
 from data.dal import DataAccessLayer
+from data.response_cache import ResponseCache
+from data.store import TimeSeriesStore
+from data.version import get_data_version
 
 from reports.correlation import get_corr
 
 # Database setup
-Session = scoped_session(sessionmaker(bind=engine))
+Session = scoped_session(sessionmaker(bind=read_engine))
 
 # Choose a Bootswatch theme
 BOOTSTRAP_THEME = dbc.themes.FLATLY
 
-app = dash.Dash(__name__, external_stylesheets=[BOOTSTRAP_THEME])
+# Page components such as the range pickers are created by render_page_content
+app = dash.Dash(
+    __name__,
+    external_stylesheets=[BOOTSTRAP_THEME],
+    suppress_callback_exceptions=True,
+)
+
+# Upper bound on points sent to the browser per series
+MAX_POINTS = 1000
+
+# Milliseconds between polls while a page is in live mode
+LIVE_INTERVAL = 60 * 1000
+
+# Points a live line keeps, oldest dropped first, so a graph left open on a
+# wall display doesn't grow without bound
+LIVE_MAX_POINTS = 2 * MAX_POINTS
+
+# Carbon intensity and weather held in memory, loaded on the first request
+store = TimeSeriesStore()
+
+# Serialized figures, keyed by the data version so each ETL load refreshes them
+response_cache = ResponseCache.from_env(encoder=PlotlyJSONEncoder)
 
 # the style arguments for the sidebar. We use position:fixed and a fixed width
 SIDEBAR_STYLE = {
@@ -61,22 +90,349 @@ content = html.Div(id="page-content", style=CONTENT_STYLE)
 app.layout = html.Div([dcc.Location(id="url"), sidebar, content])
 
 
+if metrics.ENABLED:
+
+    @app.server.route("/metrics")
+    def metrics_endpoint():
+        """Latency histograms in the Prometheus text format."""
+        return (
+            metrics.registry.render(),
+            200,
+            {"Content-Type": "text/plain; version=0.0.4"},
+        )
+
+
 # Define a function to fetch data from the database
-def fetch_data(dal_method):
+def fetch_data(dal_method, **kwargs):
     with Session() as session:
-        dal = DataAccessLayer(session)
-        data = getattr(dal, dal_method)()
+        dal = DataAccessLayer(session, store)
+        data = getattr(dal, dal_method)(**kwargs)
     return data
 
 
+def cached(build):
+    """Serve `build`'s result from response_cache for the same arguments."""
+
+    @functools.wraps(build)
+    def wrapper(*args):
+        with Session() as session:
+            version = get_data_version(session)
+        return response_cache.get_or_compute(
+            build.__name__, args, version, lambda: build(*args)
+        )
+
+    return wrapper
+
+
+def to_frame(rows, columns):
+    """DataFrame of `columns` from DAL rows, keeping the columns when empty.
+
+    Frames the store returns are used as they are, without a copy.
+    """
+    if isinstance(rows, pd.DataFrame):
+        return rows[columns]
+    return pd.DataFrame([row._asdict() for row in rows], columns=columns)
+
+
+def date_range(start_date, end_date):
+    """Convert a DatePickerRange selection into a half-open [start, end)."""
+    start = datetime.datetime.fromisoformat(start_date) if start_date else None
+    end = datetime.datetime.fromisoformat(end_date) if end_date else None
+    if end:
+        # the picker's end date is inclusive
+        end += datetime.timedelta(days=1)
+    return start, end
+
+
+def range_picker(id):
+    return dcc.DatePickerRange(id=id, clearable=True, className="mb-3")
+
+
+def live_controls(id):
+    """A Live switch with the interval it enables and a high-water mark store.
+
+    The store holds the data version the graph was read at and, once the
+    graph can be extended, what live_mark describes.
+    """
+    return html.Div(
+        [
+            dbc.Switch(id=f"{id}-live", label="Live", value=False),
+            dcc.Interval(id=f"{id}-interval", interval=LIVE_INTERVAL, disabled=True),
+            dcc.Store(id=f"{id}-mark"),
+        ]
+    )
+
+
+def live_line(df, x, y, title, live):
+    """px.line of `df`, split in two traces for live updates when `live`.
+
+    The last point is the bucket that was still filling when the graph was
+    drawn. It goes in a second trace, drawn like the first, that live polls
+    replace, while the buckets they close are appended to the first.
+    """
+    if not live or len(df) < 2:
+        return px.line(df, x=x, y=y, title=title)
+    fig = px.line(df.iloc[:-1], x=x, y=y, title=title)
+    line = fig.data[0]
+    fig.add_scatter(
+        x=df[x].iloc[-2:],
+        y=df[y].iloc[-2:],
+        mode="lines",
+        line=line.line,
+        hovertemplate=line.hovertemplate,
+        showlegend=False,
+    )
+    return fig
+
+
+def live_mark(end, df=None):
+    """High-water mark for a graph drawn by live_line; None when it has an end.
+
+    It holds the data version and, once `df` has two points, the start of
+    the bucket still filling (`after`), the bucket width in seconds (the
+    mean spacing of the points) and the last point before it (`last`).
+    """
+    if end is not None:
+        return None
+    with Session() as session:
+        mark = {"version": get_data_version(session)}
+    if df is not None and len(df) >= 2:
+        times = df.iloc[:, 0]
+        span = (times.iloc[-1] - times.iloc[0]).total_seconds()
+        mark["after"] = times.iloc[-1]
+        mark["width"] = max(int(span / (len(df) - 1)), 1)
+        mark["last"] = df.iloc[-2].to_dict()
+    return mark
+
+
+def data_changed(mark, end_date):
+    """The current data version if it moved past `mark`, otherwise None."""
+    if not mark or end_date:
+        return None
+    with Session() as session:
+        version = get_data_version(session)
+    return None if version == mark.get("version") else version
+
+
+def live_update(series, mark, end_date):
+    """extendData for each value column of `series` since `mark`, and the new mark.
+
+    New points are bucketed at the graph's resolution: closed buckets are
+    appended to the first trace and the one still filling replaces the
+    second. While the data version is unchanged this returns
+    (None, no_update), so idle polls cost a single primary key lookup. It
+    returns (None, None) when the graph has to be redrawn instead.
+    """
+    version = data_changed(mark, end_date)
+    if version is None:
+        return None, no_update
+    if not mark.get("after"):
+        return None, None
+    after = datetime.datetime.fromisoformat(mark["after"])
+    last = mark["last"]
+    x, *columns = last
+    anchor = (datetime.datetime.fromisoformat(last[x]), last[columns[0]])
+    tail = fetch_data(
+        "get_live_tail",
+        series=series,
+        drawn=mark["version"],
+        version=version,
+        after=after,
+        width=mark["width"],
+        anchor=anchor,
+    )
+    if tail is None:
+        return None, None
+    closed, current, after = tail
+    if current.empty:
+        return None, dict(mark, version=version)
+
+    if len(closed):
+        last = closed.iloc[-1].to_dict()
+    limits = [LIVE_MAX_POINTS, 2]
+    updates = [
+        (
+            dict(
+                x=[closed[x].tolist(), [last[x], current[x].iloc[0]]],
+                y=[closed[y].tolist(), [last[y], current[y].iloc[0]]],
+            ),
+            [0, 1],
+            dict(x=limits, y=limits),
+        )
+        for y in columns
+    ]
+    return updates, dict(mark, version=version, after=after, last=last)
+
+
+def toggle_live(live):
+    return not live
+
+
+for series in ["carbon", "weather"]:
+    app.callback(
+        Output(f"{series}-interval", "disabled"), Input(f"{series}-live", "value")
+    )(toggle_live)
+
+
+@app.callback(
+    [Output("carbon-graph", "figure"), Output("carbon-mark", "data")],
+    [Input("carbon-range", "start_date"), Input("carbon-range", "end_date")],
+)
+@metrics.timed
+@cached
+def update_carbon_graph(start_date, end_date):
+    start, end = date_range(start_date, end_date)
+    with metrics.stage("query"):
+        data = fetch_data(
+            "get_carbon_intensity_over_time", start=start, end=end, points=MAX_POINTS
+        )
+    with metrics.stage("frame"):
+        df = to_frame(data, ["start", "carbon_intensity"])
+    with metrics.stage("figure"):
+        fig = live_line(
+            df,
+            "start",
+            "carbon_intensity",
+            "Carbon Intensity Over Time",
+            live=end is None,
+        )
+    return fig, live_mark(end, df)
+
+
+@app.callback(
+    [
+        Output("carbon-graph", "extendData"),
+        Output("carbon-graph", "figure", allow_duplicate=True),
+        Output("carbon-mark", "data", allow_duplicate=True),
+    ],
+    Input("carbon-interval", "n_intervals"),
+    [
+        State("carbon-mark", "data"),
+        State("carbon-range", "start_date"),
+        State("carbon-range", "end_date"),
+    ],
+    prevent_initial_call=True,
+)
+@metrics.timed
+def extend_carbon_graph(n_intervals, mark, start_date, end_date):
+    updates, mark = live_update("carbon", mark, end_date)
+    if mark is None:
+        return (no_update, *update_carbon_graph(start_date, end_date))
+    return updates[0] if updates else no_update, no_update, mark
+
+
+@app.callback(
+    Output("energy-mix-graph", "figure"),
+    [Input("energy-mix-range", "start_date"), Input("energy-mix-range", "end_date")],
+)
+@metrics.timed
+@cached
+def update_energy_mix_graph(start_date, end_date):
+    start, end = date_range(start_date, end_date)
+    with metrics.stage("query"):
+        data = fetch_data("get_energy_mix", start=start, end=end)
+    with metrics.stage("frame"):
+        df = to_frame(data, ["type_name", "total_generation"])
+    with metrics.stage("figure"):
+        return px.pie(
+            df, names="type_name", values="total_generation", title="Energy Mix"
+        )
+
+
+@metrics.timed
+@cached
+def weather_figures(start_date, end_date, live):
+    """The temperature and wind figures with their mark.
+
+    Live graphs only show observed hours, so new observations extend them
+    rather than replacing the forecast hours already drawn.
+    """
+    start, end = date_range(start_date, end_date)
+    live = live and end is None
+    with metrics.stage("query"):
+        data = fetch_data(
+            "get_weather", start=start, end=end, points=MAX_POINTS, observed=live
+        )
+    with metrics.stage("frame"):
+        df = to_frame(data, ["time", "temp_c", "wind_mph"])
+    with metrics.stage("figure"):
+        # plot temperature over time
+        fig = live_line(df, "time", "temp_c", "Temperature over time", live)
+
+        # plot wind speed over time
+        fig2 = live_line(df, "time", "wind_mph", "Wind speed over time", live)
+    return fig, fig2, live_mark(end, df) if live else None
+
+
+@app.callback(
+    [
+        Output("temperature-graph", "figure"),
+        Output("wind-speed-graph", "figure"),
+        Output("weather-mark", "data"),
+    ],
+    [
+        Input("weather-range", "start_date"),
+        Input("weather-range", "end_date"),
+        Input("weather-live", "value"),
+    ],
+)
+@metrics.timed
+def update_weather_graphs(start_date, end_date, live=False):
+    return weather_figures(start_date, end_date, bool(live))
+
+
+@app.callback(
+    [
+        Output("temperature-graph", "extendData"),
+        Output("wind-speed-graph", "extendData"),
+        Output("temperature-graph", "figure", allow_duplicate=True),
+        Output("wind-speed-graph", "figure", allow_duplicate=True),
+        Output("weather-mark", "data", allow_duplicate=True),
+    ],
+    Input("weather-interval", "n_intervals"),
+    [
+        State("weather-mark", "data"),
+        State("weather-range", "start_date"),
+        State("weather-range", "end_date"),
+    ],
+    prevent_initial_call=True,
+)
+@metrics.timed
+def extend_weather_graphs(n_intervals, mark, start_date, end_date):
+    updates, mark = live_update("weather", mark, end_date)
+    if mark is None:
+        return (no_update, no_update, *weather_figures(start_date, end_date, True))
+    return (*(updates or [no_update] * 2), no_update, no_update, mark)
+
+
+@metrics.timed
+@cached
+def wind_figures():
+    with metrics.stage("query"):
+        data = fetch_data("get_wind_data")
+    with metrics.stage("frame"):
+        df = pd.DataFrame(data, columns=["hour", "wind_speed", "wind_generation"])
+    with metrics.stage("figure"):
+        figure = px.line(df, x="hour", y="wind_speed", title="Wind Speed Over Time")
+        figure2 = px.line(
+            df, x="hour", y="wind_generation", title="Wind Energy Generation Over Time"
+        )
+    return figure, figure2
+
+
+@metrics.timed
+@cached
+def correlation_markdown():
+    with metrics.stage("query"):
+        corr = get_corr()
+    with metrics.stage("markdown"):
+        return corr.to_markdown()
+
+
 @app.callback(Output("page-content", "children"), [Input("url", "pathname")])
+@metrics.timed
 def render_page_content(pathname):
     if pathname in ["/", "/page-1"]:
-        data = fetch_data("get_carbon_intensity_over_time")
-        df = pd.DataFrame(data)
-        figure = px.line(
-            df, x="start", y="carbon_intensity", title="Carbon Intensity Over Time"
-        )
         return html.Div(
             [
                 dcc.Markdown(
@@ -86,15 +442,12 @@ def render_page_content(pathname):
                 Lower carbon intensity indicates a cleaner energy mix.
             """
                 ),
-                dcc.Graph(figure=figure),
+                range_picker("carbon-range"),
+                live_controls("carbon"),
+                dcc.Graph(id="carbon-graph"),
             ]
         )
     elif pathname == "/page-3":
-        data = fetch_data("get_energy_mix")
-        df = pd.DataFrame(data)
-        figure = px.pie(
-            df, names="type_name", values="total_generation", title="Energy Mix"
-        )
         return html.Div(
             [
                 dcc.Markdown(
@@ -104,17 +457,11 @@ def render_page_content(pathname):
                 A diverse energy mix can be more resilient and sustainable.
             """
                 ),
-                dcc.Graph(figure=figure),
+                range_picker("energy-mix-range"),
+                dcc.Graph(id="energy-mix-graph"),
             ]
         )
     elif pathname == "/page-5":
-        data = fetch_data("get_weather")
-        df = pd.DataFrame(data)
-        # plot temperature over time
-        fig = px.line(df, x="time", y="temp_c", title="Temperature over time")
-
-        # plot wind speed over time
-        fig2 = px.line(df, x="time", y="wind_mph", title="Wind speed over time")
         return html.Div(
             [
                 dcc.Markdown(
@@ -123,17 +470,14 @@ def render_page_content(pathname):
                 The line charts show the temperature and wind speed over time.
             """
                 ),
-                dcc.Graph(figure=fig),
-                dcc.Graph(figure=fig2),
+                range_picker("weather-range"),
+                live_controls("weather"),
+                dcc.Graph(id="temperature-graph"),
+                dcc.Graph(id="wind-speed-graph"),
             ]
         )
     elif pathname == "/page-6":
-        data = fetch_data("get_wind_data")
-        df = pd.DataFrame(data, columns=["hour", "wind_speed", "wind_generation"])
-        figure = px.line(df, x="hour", y="wind_speed", title="Wind Speed Over Time")
-        figure2 = px.line(
-            df, x="hour", y="wind_generation", title="Wind Energy Generation Over Time"
-        )
+        figure, figure2 = wind_figures()
         return html.Div(
             [
                 dcc.Markdown(
@@ -147,8 +491,6 @@ def render_page_content(pathname):
             ]
         )
     elif pathname == "/page-7":
-        corr = get_corr()
-
         return html.Div(
             [
                 dcc.Markdown(
@@ -158,7 +500,7 @@ def render_page_content(pathname):
             """
                 ),
                 # display correlation matrix as dataframe
-                dcc.Markdown(corr.to_markdown()),
+                dcc.Markdown(correlation_markdown()),
             ]
         )
 
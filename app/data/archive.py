@@ -0,0 +1,277 @@
+"""Columnar Parquet archive for closed months of history.
+
+Closed months of periods, energy types, per-period generation and weather
+are compacted into <ARCHIVE_PATH>/<dataset>/month=YYYY-MM/part-0.parquet
+and recorded in the archived_months table with the data version they were
+written at. SQLite keeps every row, so the loaders never need the archive.
+read_table serves a dataset from the archive for archived months and from
+SQLite for every other range, reading only the requested columns and months.
+
+Backfills and revisions can still write into archived months. A month whose
+table data_changes reports as changed at or before the month's end, after
+the month was written, is stale: read_table reads it from SQLite and the
+next compact() rewrites it. The scheduler runs compact() daily; it can also
+be run with `python -m app.data.archive`.
+
+Requires pyarrow, which is an optional dependency.
+"""
+
+import datetime
+import os
+
+from sqlalchemy import DateTime, Float, Integer, func, select, text
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from .db import engine
+from .models import (
+    FUEL_COLUMNS,
+    ArchivedMonth,
+    EnergyType,
+    Generation,
+    Period,
+    PeriodGeneration,
+    Weather,
+)
+from .rollups import next_bucket
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # optional dependency
+    pa = pq = None
+
+ARCHIVE_PATH = os.environ.get("ARCHIVE_PATH", "archive")
+
+# dataset -> (query, column holding the row's time, table in data_changes)
+DATASETS = {
+    "periods": (
+        select(
+            Period.start,
+            Period.end,
+            Period.carbon_intensity,
+            Period.settlement_period,
+            Generation.total.label("generation_total"),
+        ).outerjoin(Generation),
+        Period.start,
+        "periods",
+    ),
+    "energy_types": (
+        select(
+            Period.start,
+            EnergyType.type_name,
+            EnergyType.total,
+            EnergyType.percentage,
+        ).join(Period),
+        Period.start,
+        "periods",
+    ),
+    "period_generation": (
+        select(
+            PeriodGeneration.start,
+            *(getattr(PeriodGeneration, column) for column in FUEL_COLUMNS.values()),
+            PeriodGeneration.other,
+        ),
+        PeriodGeneration.start,
+        "periods",
+    ),
+    "weather": (
+        select(*[column for column in Weather.__table__.columns if column.key != "id"]),
+        Weather.time,
+        "weather",
+    ),
+}
+
+
+def _require_pyarrow():
+    if pa is None:
+        raise ImportError("The Parquet archive needs pyarrow: pip install pyarrow")
+
+
+def _arrow_type(column):
+    if isinstance(column.type, DateTime):
+        return pa.timestamp("us")
+    if isinstance(column.type, Float):
+        return pa.float64()
+    if isinstance(column.type, Integer):
+        return pa.int64()
+    return pa.string()
+
+
+def _columns(dataset, columns=None):
+    query, _, _ = DATASETS[dataset]
+    if columns is None:
+        return list(query.selected_columns)
+    return [query.selected_columns[name] for name in columns]
+
+
+def _read_sqlite(connection, dataset, low=None, high=None, columns=None):
+    query, time_column, _ = DATASETS[dataset]
+    selected = _columns(dataset, columns)
+    query = query.with_only_columns(*selected).order_by(time_column)
+    if low is not None:
+        query = query.where(time_column >= low)
+    if high is not None:
+        query = query.where(time_column < high)
+
+    rows = connection.execute(query).all()
+    schema = pa.schema([(column.key, _arrow_type(column)) for column in selected])
+    return pa.Table.from_pydict(
+        {name: [row[i] for row in rows] for i, name in enumerate(schema.names)},
+        schema=schema,
+    )
+
+
+def _month_bounds(month):
+    low = datetime.datetime.strptime(month, "%Y-%m")
+    return low, next_bucket(low, "month")
+
+
+def _partition(archive_path, dataset, month):
+    return os.path.join(archive_path, dataset, f"month={month}", "part-0.parquet")
+
+
+def archived_months(connection, dataset):
+    """Months of `dataset` whose Parquet file is current, oldest first.
+
+    A month is stale when a version after the one it was written at changed
+    its table at or before the month's end, or when data_changes no longer
+    reaches back to that version.
+    """
+    _, _, table = DATASETS[dataset]
+    return list(
+        connection.execute(
+            text("""
+                SELECT a.month FROM archived_months a
+                WHERE a.dataset = :dataset
+                    AND (
+                        a.version >= :current
+                        OR a.version >= (SELECT MIN(version) FROM data_changes) - 1
+                    )
+                    AND NOT EXISTS (
+                        SELECT 1 FROM data_changes c
+                        WHERE c.version > a.version
+                            AND c.table_name IN (:table, '*')
+                            AND (
+                                c.since IS NULL
+                                OR c.since < date(a.month || '-01', '+1 month')
+                            )
+                    )
+                ORDER BY a.month
+                """),
+            {
+                "dataset": dataset,
+                "table": table,
+                "current": _data_version(connection),
+            },
+        ).scalars()
+    )
+
+
+def _data_version(connection):
+    version = connection.execute(text("SELECT version FROM data_version")).scalar()
+    return version or 0
+
+
+def compact(engine=engine, archive_path=ARCHIVE_PATH, before=None):
+    """Write every closed month that isn't archived, or is stale, to Parquet.
+
+    Months starting before `before` (default: the start of the current month)
+    are closed. The rows stay in SQLite. Returns {dataset: [months written]}.
+    """
+    _require_pyarrow()
+    before = before or datetime.datetime.now().replace(
+        day=1, hour=0, minute=0, second=0, microsecond=0
+    )
+
+    archived = {}
+    with engine.begin() as connection:
+        version = _data_version(connection)
+        for dataset, (_, time_column, _) in DATASETS.items():
+            stored = connection.execute(
+                select(func.strftime("%Y-%m", time_column))
+                .where(time_column < before)
+                .distinct()
+            ).scalars()
+            current = archived_months(connection, dataset)
+            months = sorted(set(stored) - set(current))
+            # Months still current are current at this version too; moving
+            # them forward keeps them within reach of the trimmed change log
+            connection.execute(
+                ArchivedMonth.__table__.update()
+                .where(
+                    ArchivedMonth.dataset == dataset,
+                    ArchivedMonth.month.in_(current),
+                )
+                .values(version=version)
+            )
+            for month in months:
+                table = _read_sqlite(connection, dataset, *_month_bounds(month))
+                path = _partition(archive_path, dataset, month)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                # Replace a stale file in one step; readers may have it open
+                pq.write_table(table, path + ".partial")
+                os.replace(path + ".partial", path)
+                statement = sqlite_insert(ArchivedMonth.__table__).values(
+                    dataset=dataset,
+                    month=month,
+                    rows=table.num_rows,
+                    archived_at=datetime.datetime.utcnow(),
+                    version=version,
+                )
+                connection.execute(
+                    statement.on_conflict_do_update(
+                        index_elements=["dataset", "month"],
+                        set_={
+                            column: statement.excluded[column]
+                            for column in ("rows", "archived_at", "version")
+                        },
+                    )
+                )
+            archived[dataset] = months
+    return archived
+
+
+def read_table(
+    connection, dataset, columns=None, start=None, end=None, archive_path=ARCHIVE_PATH
+):
+    """Read a dataset for [start, end) as a pyarrow Table.
+
+    Archived months come from memory-mapped Parquet files, reading only
+    `columns`; the ranges before, between and after them come from SQLite.
+    Rows are in time order.
+    """
+    _require_pyarrow()
+    _, time_column, _ = DATASETS[dataset]
+    months = archived_months(connection, dataset)
+
+    tables = []
+    # Everything before `covered` has been read
+    covered = start
+    for month in months:
+        low, high = _month_bounds(month)
+        if (start and high <= start) or (end and low >= end):
+            continue
+        if covered is None or covered < low:
+            tables.append(_read_sqlite(connection, dataset, covered, low, columns))
+        filters = []
+        if start and low < start:
+            filters.append((time_column.key, ">=", start))
+        if end and high > end:
+            filters.append((time_column.key, "<", end))
+        tables.append(
+            pq.read_table(
+                _partition(archive_path, dataset, month),
+                columns=columns,
+                filters=filters or None,
+                memory_map=True,
+            )
+        )
+        covered = high
+
+    if end is None or covered is None or covered < end:
+        tables.append(_read_sqlite(connection, dataset, covered, end, columns))
+    return pa.concat_tables(tables)
+
+
+if __name__ == "__main__":
+    print(compact())
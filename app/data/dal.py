@@ -1,14 +1,105 @@
-from sqlalchemy import func
-from .models import Period, EnergyType, Weather
+import calendar
+import collections
+import datetime
+import json
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import func, cast, Integer, literal
+from .models import (
+    FUEL_COLUMNS,
+    Period,
+    PeriodGeneration,
+    Weather,
+    EnergyRollup,
+    CarbonRollup,
+)
+from .rollups import choose_resolution
+from .downsample import lttb, lttb_buckets
+from .version import get_changes
+from . import archive, metrics
+
+# (x column, value columns, observed hours only, how a bucket becomes one
+# point: "lttb" or "mean") of the series the dashboard appends to live
+LIVE_SERIES = {
+    "carbon": (Period.start, [Period.carbon_intensity], False, "lttb"),
+    "weather": (Weather.time, [Weather.temp_c, Weather.wind_mph], True, "mean"),
+}
+
+EnergyMix = collections.namedtuple("EnergyMix", "type_name total_generation")
 
 
 class DataAccessLayer:
-    def __init__(self, session):
+    def __init__(self, session, store=None):
+        # With a TimeSeriesStore, the time series reads it covers are served
+        # from memory instead of SQLite
         self.session = session
+        self.store = store
+        if store is not None:
+            with metrics.stage("store_refresh"):
+                store.refresh(session)
+
+    def _span(self, column, start, end, *criteria):
+        """Resolve open range bounds against the stored data."""
+        if start is None or end is None:
+            first, last = (
+                self.session.query(func.min(column), func.max(column))
+                .filter(*criteria)
+                .one()
+            )
+            start = start or first
+            end = end or last
+        return start, end
+
+    @metrics.timed(rows=True)
+    def get_carbon_intensity_over_time(
+        self, start=None, end=None, resolution=None, points=None
+    ):
+        """Retrieve carbon intensity over time.
+
+        With a `resolution` (timedelta) the coarsest rollup that fits is read
+        instead of the raw periods, adding min/max columns per bucket. With
+        `points` the resolution is derived from the range and the result is
+        downsampled to at most that many rows. Served from the store, the
+        result is a DataFrame over its arrays rather than a list of rows.
+        """
+        if self.store is not None and (points or resolution is None):
+            return self.store.carbon_intensity(start, end, points)
+
+        if points:
+            first, last = self._span(Period.start, start, end)
+            if first is None:
+                return []
+            resolution = resolution or (last - first) / points
+            rows = self.get_carbon_intensity_over_time(start, end, resolution)
+            rows = [row for row in rows if row.carbon_intensity is not None]
+            return lttb(
+                rows,
+                points,
+                x=lambda row: row.start.timestamp(),
+                y=lambda row: row.carbon_intensity,
+            )
+
+        rollup = choose_resolution(start, end, resolution) if resolution else None
+        if rollup is None:
+            query = self.session.query(Period.start, Period.carbon_intensity)
+            if start:
+                query = query.filter(Period.start >= start)
+            if end:
+                query = query.filter(Period.start < end)
+            return query.order_by(Period.start).all()
 
-    def get_carbon_intensity_over_time(self):
-        """Retrieve carbon intensity over time."""
-        return self.session.query(Period.start, Period.carbon_intensity).all()
+        query = self.session.query(
+            CarbonRollup.bucket.label("start"),
+            CarbonRollup.mean_intensity.label("carbon_intensity"),
+            CarbonRollup.min_intensity.label("min_carbon_intensity"),
+            CarbonRollup.max_intensity.label("max_carbon_intensity"),
+        ).filter(CarbonRollup.resolution == rollup)
+        if start:
+            query = query.filter(CarbonRollup.bucket >= start)
+        if end:
+            query = query.filter(CarbonRollup.bucket < end)
+        return query.order_by(CarbonRollup.bucket).all()
 
     """ def get_total_demand_and_generation_over_time(self):
         
@@ -24,23 +115,62 @@ class DataAccessLayer:
             .all()
         ) """
 
-    def get_energy_mix(self, specific_time=None):
-        """Retrieve energy mix."""
-        query = (
-            self.session.query(
-                EnergyType.type_name,
-                func.sum(EnergyType.total).label("total_generation"),
+    @metrics.timed(rows=True)
+    def get_energy_mix(self, specific_time=None, start=None, end=None):
+        """Retrieve energy mix, optionally over periods starting in [start, end).
+
+        Read from the coarsest rollup whose buckets line up with the range,
+        otherwise summed from the per-fuel columns of period_generation.
+        """
+        rollup = None if specific_time else choose_resolution(start, end)
+        if rollup is not None:
+            query = (
+                self.session.query(
+                    EnergyRollup.type_name,
+                    func.sum(EnergyRollup.total).label("total_generation"),
+                )
+                .filter(EnergyRollup.resolution == rollup)
+                .group_by(EnergyRollup.type_name)
             )
-            .join(Period)
-            .group_by(EnergyType.type_name)
-        )
+            if start:
+                query = query.filter(EnergyRollup.bucket >= start)
+            if end:
+                query = query.filter(EnergyRollup.bucket < end)
+            return query.all()
 
+        # Fuels outside FUEL_COLUMNS come back as a JSON array of the
+        # periods' overflow objects
+        query = self.session.query(
+            *(
+                func.sum(getattr(PeriodGeneration, column))
+                for column in FUEL_COLUMNS.values()
+            ),
+            func.json_group_array(func.json(PeriodGeneration.other)).filter(
+                PeriodGeneration.other.isnot(None)
+            ),
+        ).select_from(PeriodGeneration)
         if specific_time:
-            query = query.filter(
+            query = query.join(Period).filter(
                 Period.start <= specific_time, Period.end > specific_time
             )
+        if start:
+            query = query.filter(PeriodGeneration.start >= start)
+        if end:
+            query = query.filter(PeriodGeneration.start < end)
+        *totals, other = query.one()
 
-        return query.all()
+        mix = [
+            EnergyMix(type_name, total)
+            for type_name, total in zip(FUEL_COLUMNS, totals)
+            if total is not None
+        ]
+        overflow = collections.Counter()
+        for entry in json.loads(other):
+            overflow.update(
+                {name: total for name, total in entry.items() if total is not None}
+            )
+        mix.extend(EnergyMix(*item) for item in overflow.items())
+        return sorted(mix)
 
     """ def get_demand_breakdown(self):
         
@@ -61,42 +191,166 @@ class DataAccessLayer:
             .all()
         ) """
 
-    def get_weather(self):
-        return self.session.query(
-            Weather.time,
-            Weather.temp_c,
-            Weather.wind_mph,
-            Weather.wind_dir,
-            Weather.pressure_mb,
-            Weather.humidity,
-            Weather.gust_mph,
-        ).all()
-
-    def get_wind_data(self):
-        """Retrieve wind speed and wind energy generation."""
+    @metrics.timed(rows=True)
+    def read_history(self, dataset, columns=None, start=None, end=None):
+        """Read "periods", "energy_types" or "weather" for [start, end).
+
+        Returns a pyarrow Table that reads archived months from Parquet and
+        every other month from SQLite.
+        """
+        return archive.read_table(
+            self.session.connection(), dataset, columns, start, end
+        )
+
+    @metrics.timed(rows=True)
+    def get_weather(self, start=None, end=None, points=None, observed=False):
+        """Retrieve weather for times in [start, end).
+
+        With `points` the hours are averaged into at most that many equal
+        time buckets in SQL. wind_dir can't be averaged and is None then.
+        Those buckets come from the store, as a DataFrame, when there is one.
+        With `observed` forecast hours are left out.
+        """
+        if self.store is not None and points:
+            return self.store.weather(start, end, points, observed)
+
+        criteria = [Weather.prediction == 0] if observed else []
+        if not points:
+            query = self.session.query(
+                Weather.time,
+                Weather.temp_c,
+                Weather.wind_mph,
+                Weather.wind_dir,
+                Weather.pressure_mb,
+                Weather.humidity,
+                Weather.gust_mph,
+            )
+        else:
+            first, last = self._span(Weather.time, start, end, *criteria)
+            if first is None:
+                return []
+            width = max(int((last - first).total_seconds() / points) + 1, 1)
+            epoch = cast(func.strftime("%s", Weather.time), Integer)
+            bucket = (epoch - calendar.timegm(first.timetuple())) // width
+            query = self.session.query(
+                func.min(Weather.time).label("time"),
+                func.avg(Weather.temp_c).label("temp_c"),
+                func.avg(Weather.wind_mph).label("wind_mph"),
+                literal(None).label("wind_dir"),
+                func.avg(Weather.pressure_mb).label("pressure_mb"),
+                func.avg(Weather.humidity).label("humidity"),
+                func.avg(Weather.gust_mph).label("gust_mph"),
+            ).group_by(bucket)
+
+        query = query.filter(*criteria)
+        if start:
+            query = query.filter(Weather.time >= start)
+        if end:
+            query = query.filter(Weather.time < end)
+        return query.order_by(Weather.time if not points else "time").all()
+
+    @metrics.timed(rows=True)
+    def get_points_after(self, series, after):
+        """A DataFrame of a LIVE_SERIES entry with x after `after`, oldest first.
+
+        Every row when `after` is None. A binary search in the store when
+        there is one, otherwise a range scan on the x index, so the cost is
+        proportional to the number of new rows.
+        """
+        x, values, observed, _ = LIVE_SERIES[series]
+        fields = [column.key for column in [x, *values]]
+        if self.store is not None:
+            return self.store.points_after(series, after, fields, observed)
+        query = self.session.query(x, *values)
+        if observed:
+            query = query.filter(Weather.prediction == 0)
+        if after is not None:
+            query = query.filter(x > after)
+        return pd.DataFrame(query.order_by(x).all(), columns=fields)
+
+    @metrics.timed
+    def get_live_tail(self, series, drawn, version, after, width, anchor=None):
+        """New points for a live graph of a LIVE_SERIES entry, at its resolution.
+
+        The graph was drawn from data version `drawn` at one point per
+        `width` seconds and ends with the bucket starting at `after`, which
+        was still filling. Each `width` bucket from there that a later point
+        has closed becomes one point: the one LTTB keeps, with `anchor`, the
+        (x, y) drawn before the bucket, as the first triangle vertex; or the
+        bucket's mean, as in get_weather.
+
+        Returns (closed, current, after): DataFrames of those points and of
+        the bucket still filling (its mean, or its newest point for LTTB),
+        and where that bucket starts. Returns None when a change between
+        `drawn` and `version` reached back before `after`, so the graph
+        must be redrawn.
+        """
+        x, values, _, reduce = LIVE_SERIES[series]
+        changes = get_changes(self.session, drawn, version)
+        if changes is None:
+            return None
+        since = changes.get(x.table.name)
+        if since is not None and since < after:
+            return None
+
+        # Times are whole seconds, so this takes the points from `after` on
+        frame = self.get_points_after(series, after - datetime.timedelta(seconds=1))
+        if reduce == "lttb":
+            frame = frame.dropna()
+        if frame.empty:
+            return frame, frame, after
+
+        seconds = (frame[x.key] - after).dt.total_seconds().to_numpy()
+        buckets = (seconds // width).astype(np.int64)
+        # Buckets are in time order, so each one is a contiguous run
+        starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+        after += datetime.timedelta(seconds=int(buckets[-1]) * width)
+
+        if reduce == "lttb":
+            times = frame[x.key].to_numpy().astype("datetime64[s]").astype(np.int64)
+            kept = lttb_buckets(
+                times,
+                frame[values[0].key].to_numpy(),
+                [*starts, len(frame)],
+                (calendar.timegm(anchor[0].timetuple()), anchor[1]),
+            )
+            return frame.iloc[kept], frame.iloc[-1:], after
+
+        means = frame.groupby(buckets).agg(
+            {x.key: "min", **{column.key: "mean" for column in values}}
+        )
+        return means.iloc[:-1], means.iloc[-1:], after
+
+    @metrics.timed(rows=True)
+    def get_wind_data(self, date=None, cutoff_hour=14):
+        """Retrieve hourly wind speed and wind energy generation.
+
+        Covers `date` (default today) from midnight up to and including
+        `cutoff_hour`. Both sides filter on half-open timestamp ranges so the
+        time indexes are used.
+        """
+        day_start = datetime.datetime.combine(
+            date or datetime.date.today(), datetime.time()
+        )
+        cutoff = day_start + datetime.timedelta(hours=cutoff_hour + 1)
+
         wind_speed = (
             self.session.query(
                 func.strftime("%H", Weather.time).label("hour"),
                 func.avg(Weather.wind_mph).label("wind_speed"),
             )
-            .filter(
-                func.strftime("%Y-%m-%d", Weather.time)
-                == func.strftime("%Y-%m-%d", func.current_date())
-            )
-            .filter(func.strftime("%H:%M:%S", Weather.time) <= "14:00:00")
+            .filter(Weather.time >= day_start, Weather.time < cutoff)
             .group_by("hour")
         ).subquery()
 
         wind_generation = (
             self.session.query(
-                func.strftime("%H", Period.start).label("hour"),
-                func.sum(EnergyType.total).label("wind_generation"),
+                func.strftime("%H", PeriodGeneration.start).label("hour"),
+                func.sum(PeriodGeneration.wind).label("wind_generation"),
             )
-            .join(EnergyType)
-            .filter(EnergyType.type_name == "Wind")
+            .filter(PeriodGeneration.wind.isnot(None))
             .filter(
-                func.strftime("%Y-%m-%d", Period.start)
-                == func.strftime("%Y-%m-%d", func.current_date())
+                PeriodGeneration.start >= day_start, PeriodGeneration.start < cutoff
             )
             .group_by("hour")
         ).subquery()
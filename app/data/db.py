@@ -1,12 +1,64 @@
+import os
+
 from sqlalchemy import (
     create_engine,
+    event,
 )
 from sqlalchemy.ext.declarative import declarative_base
 
+from . import metrics
+
 # Create a base class for declarative class definitions
 Base = declarative_base()
 
+# Database file, relative to the working directory unless absolute
+DATABASE_PATH = os.environ.get("DATABASE_PATH", "data.db")
+
+# Applied to every new connection. WAL lets the dashboard keep reading while
+# the ETL commits; NORMAL sync is durable across application crashes in WAL.
+PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "busy_timeout": 5000,
+    "cache_size": -64000,  # negative means KiB, so 64 MB
+    "mmap_size": 256 * 1024 * 1024,
+    "temp_store": "MEMORY",
+}
+
+
+def make_engine(path=None, readonly=False, pool_size=None, **pragmas):
+    """Create an engine for the SQLite database at `path`.
+
+    Every connection gets PRAGMAS, updated with `pragmas`. Read-only engines
+    set query_only and pool several connections for concurrent readers;
+    write engines keep a small pool since SQLite has a single writer.
+    """
+    path = path or DATABASE_PATH
+    settings = dict(PRAGMAS, **pragmas)
+    if readonly:
+        settings["query_only"] = "ON"
+
+    engine = create_engine(
+        f"sqlite:///{path}",
+        pool_size=pool_size or (8 if readonly else 1),
+        max_overflow=8 if readonly else 2,
+        pool_timeout=settings["busy_timeout"] / 1000,
+    )
+
+    @event.listens_for(engine, "connect")
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in settings.items():
+            cursor.execute(f"PRAGMA {name} = {value}")
+        cursor.close()
+
+    if metrics.ENABLED:
+        metrics.instrument_engine(engine)
+    return engine
+
+
 # create file data.db
-engine = create_engine("sqlite:///data.db")
+engine = make_engine()
+read_engine = make_engine(readonly=True)
 
 Base.metadata.create_all(engine)
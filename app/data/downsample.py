@@ -0,0 +1,99 @@
+import numpy as np
+
+
+def lttb(rows, threshold, x, y):
+    """Downsample `rows` to `threshold` rows with Largest-Triangle-Three-Buckets.
+
+    `x` and `y` map a row to numbers. The first and last rows are always kept
+    and each bucket in between keeps the row that best preserves the shape of
+    the line, so peaks and troughs survive.
+    """
+    rows = list(rows)
+    if threshold >= len(rows) or threshold < 3:
+        return rows
+
+    xs = [x(row) for row in rows]
+    ys = [y(row) for row in rows]
+    every = (len(rows) - 2) / (threshold - 2)
+
+    sampled = [rows[0]]
+    anchor = 0
+    for i in range(threshold - 2):
+        # average of the next bucket is the third point of the triangle
+        next_start = int((i + 1) * every) + 1
+        next_end = min(int((i + 2) * every) + 1, len(rows))
+        avg_x = sum(xs[next_start:next_end]) / (next_end - next_start)
+        avg_y = sum(ys[next_start:next_end]) / (next_end - next_start)
+
+        best_area = -1.0
+        best = next_start
+        for j in range(int(i * every) + 1, next_start):
+            area = abs(
+                (xs[anchor] - avg_x) * (ys[j] - ys[anchor])
+                - (xs[anchor] - xs[j]) * (avg_y - ys[anchor])
+            )
+            if area > best_area:
+                best_area = area
+                best = j
+        sampled.append(rows[best])
+        anchor = best
+
+    sampled.append(rows[-1])
+    return sampled
+
+
+def lttb_indices(xs, ys, threshold):
+    """Indices of the points lttb keeps, for NumPy arrays `xs` and `ys`.
+
+    The same selection as lttb, with each bucket's triangle areas computed
+    in one vectorized step.
+    """
+    xs = np.asarray(xs, dtype=np.float64)
+    ys = np.asarray(ys, dtype=np.float64)
+    n = len(xs)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+
+    every = (n - 2) / (threshold - 2)
+    kept = np.empty(threshold, dtype=np.int64)
+    kept[0] = 0
+    kept[-1] = n - 1
+    anchor = 0
+    for i in range(threshold - 2):
+        next_start = int((i + 1) * every) + 1
+        next_end = min(int((i + 2) * every) + 1, n)
+        avg_x = xs[next_start:next_end].mean()
+        avg_y = ys[next_start:next_end].mean()
+
+        first = int(i * every) + 1
+        areas = np.abs(
+            (xs[anchor] - avg_x) * (ys[first:next_start] - ys[anchor])
+            - (xs[anchor] - xs[first:next_start]) * (avg_y - ys[anchor])
+        )
+        anchor = first + int(np.argmax(areas))
+        kept[i + 1] = anchor
+    return kept
+
+
+def lttb_buckets(xs, ys, bounds, anchor):
+    """Indices lttb keeps from the buckets of NumPy arrays `xs` and `ys`.
+
+    Bucket i is the slice [bounds[i], bounds[i + 1]). The last bucket only
+    supplies the third point of the triangle, so one index is returned per
+    bucket before it. `anchor` is the (x, y) kept before the first bucket.
+    """
+    xs = np.asarray(xs, dtype=np.float64)
+    ys = np.asarray(ys, dtype=np.float64)
+    anchor_x, anchor_y = anchor
+    kept = np.empty(max(len(bounds) - 2, 0), dtype=np.int64)
+    for i in range(len(kept)):
+        first, next_start, next_end = bounds[i], bounds[i + 1], bounds[i + 2]
+        avg_x = xs[next_start:next_end].mean()
+        avg_y = ys[next_start:next_end].mean()
+        areas = np.abs(
+            (anchor_x - avg_x) * (ys[first:next_start] - anchor_y)
+            - (anchor_x - xs[first:next_start]) * (avg_y - anchor_y)
+        )
+        kept[i] = first + int(np.argmax(areas))
+        anchor_x, anchor_y = xs[kept[i]], ys[kept[i]]
+    return kept
@@ -0,0 +1,221 @@
+"""Latency instrumentation for the dashboard and the ETL.
+
+Enabled by setting METRICS_ENABLED=1. When it is off, `timed` returns the
+function unchanged, `stage` returns a shared no-op context manager and
+engines are not instrumented, so the cost is one attribute lookup per stage.
+
+When on:
+
+- `instrument_engine` records every statement's time and, for writes, its
+  row count. Each one is labelled with the current tag, normally the
+  DataAccessLayer method or callback that issued it. Statements slower
+  than SLOW_QUERY_SECONDS are logged with their EXPLAIN QUERY PLAN.
+- `timed` wraps a function: it tags the statements run inside it and
+  records its duration and, optionally, the rows it returns.
+- `stage` times a block, e.g. the pandas or Plotly step of a callback.
+
+`registry.render()` returns every histogram in the Prometheus text format.
+SQLite does most of a SELECT's work while rows are fetched, after the
+statement event fires, so the gap between a DAL call and its statements is
+row fetching plus ORM hydration.
+"""
+
+import collections
+import contextlib
+import contextvars
+import functools
+import logging
+import os
+import threading
+import time
+
+from sqlalchemy import event
+
+logger = logging.getLogger(__name__)
+
+ENABLED = os.environ.get("METRICS_ENABLED", "0") == "1"
+SLOW_QUERY_SECONDS = float(os.environ.get("SLOW_QUERY_SECONDS", 0.1))
+
+# Histogram bucket upper bounds, in seconds
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+_tag = contextvars.ContextVar("metrics_tag", default="")
+_disabled = contextlib.nullcontext()
+
+# EXPLAIN QUERY PLAN output by statement text, so each slow statement is
+# only explained once; cleared when it reaches MAX_PLANS entries
+MAX_PLANS = 1000
+_plans = {}
+
+
+class Histogram:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                break
+        else:
+            i = len(self.buckets)
+        self.counts[i] += 1
+        self.count += 1
+        self.sum += value
+
+
+class Registry:
+    """Histograms keyed by metric name and labels."""
+
+    def __init__(self):
+        self.histograms = {}
+        self.slow_queries = collections.deque(maxlen=50)
+        self._lock = threading.Lock()
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def render(self):
+        """All histograms in the Prometheus text exposition format."""
+        lines = []
+        with self._lock:
+            by_name = collections.defaultdict(list)
+            for (name, labels), histogram in sorted(self.histograms.items()):
+                by_name[name].append((labels, histogram))
+            for name, series in by_name.items():
+                lines.append(f"# TYPE {name} histogram")
+                for labels, histogram in series:
+                    label_text = ",".join(
+                        f'{key}="{_escape(value)}"' for key, value in labels
+                    )
+                    cumulative = 0
+                    bounds = [str(bound) for bound in histogram.buckets] + ["+Inf"]
+                    for bound, count in zip(bounds, histogram.counts):
+                        cumulative += count
+                        le = f'le="{bound}"'
+                        joined = f"{label_text},{le}" if label_text else le
+                        lines.append(f"{name}_bucket{{{joined}}} {cumulative}")
+                    lines.append(f"{name}_sum{{{label_text}}} {histogram.sum}")
+                    lines.append(f"{name}_count{{{label_text}}} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+
+def _escape(value):
+    """Escape a label value for the Prometheus text format."""
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+@contextlib.contextmanager
+def tagged(tag):
+    """Label the statements and stages run inside the block with `tag`."""
+    token = _tag.set(tag)
+    try:
+        yield
+    finally:
+        _tag.reset(token)
+
+
+@contextlib.contextmanager
+def _stage(name):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        registry.observe(
+            "stage_seconds",
+            time.perf_counter() - started,
+            tag=_tag.get(),
+            stage=name,
+        )
+
+
+def stage(name):
+    """Time the block as stage `name` of the current tag."""
+    return _stage(name) if ENABLED else _disabled
+
+
+def timed(func=None, *, rows=False):
+    """Record a function's duration and tag the statements it runs.
+
+    With `rows`, also record the number of rows it returns.
+    """
+    if func is None:
+        return functools.partial(timed, rows=rows)
+    if not ENABLED:
+        return func
+    name = f"{func.__module__.removeprefix('app.')}.{func.__qualname__}"
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        with tagged(name):
+            result = func(*args, **kwargs)
+        registry.observe("call_seconds", time.perf_counter() - started, function=name)
+        if rows:
+            registry.observe("call_rows", len(result), function=name)
+        return result
+
+    return wrapper
+
+
+def _explain(cursor, statement, parameters):
+    plan = _plans.get(statement)
+    if plan is None:
+        if len(_plans) >= MAX_PLANS:
+            _plans.clear()
+        plan = _plans[statement] = _query_plan(cursor, statement, parameters)
+    return plan
+
+
+def _query_plan(cursor, statement, parameters):
+    try:
+        plan = cursor.connection.execute(
+            f"EXPLAIN QUERY PLAN {statement}", parameters
+        ).fetchall()
+    except Exception as e:  # the plan is best effort
+        return [repr(e)]
+    return [row[-1] for row in plan]
+
+
+def instrument_engine(engine):
+    """Attach statement timing and the slow-query log to `engine`."""
+
+    # The start time lives on the statement's execution context, so a
+    # statement that raises leaves nothing behind on the connection
+    @event.listens_for(engine, "before_cursor_execute")
+    def before(conn, cursor, statement, parameters, context, executemany):
+        context._query_started = time.perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - context._query_started
+        tag = _tag.get()
+        verb = statement.lstrip().split(None, 1)[0].upper()
+        registry.observe("sql_seconds", elapsed, tag=tag, statement=verb)
+        if verb != "SELECT" and cursor.rowcount >= 0:
+            registry.observe("sql_rows", cursor.rowcount, tag=tag, statement=verb)
+
+        if elapsed >= SLOW_QUERY_SECONDS:
+            plan = (
+                _explain(cursor, statement, parameters)
+                if verb == "SELECT" and not executemany
+                else []
+            )
+            registry.slow_queries.append((tag, elapsed, statement, plan))
+            logger.warning(
+                "Slow query (%.0f ms, %s): %s\n  plan: %s",
+                elapsed * 1000,
+                tag or "untagged",
+                " ".join(statement.split()),
+                "; ".join(plan),
+            )
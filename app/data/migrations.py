@@ -0,0 +1,127 @@
+from .db import Base, engine
+from . import models  # noqa: F401  register every table on Base.metadata
+from .models import FUEL_COLUMNS
+from .rollups import rebuild_rollups
+
+
+def _dedupe_periods(connection):
+    """Drop duplicate (start, end) periods so the unique index can be built.
+
+    The lowest id is kept; duplicates and their child rows are deleted since
+    they were repeated loads of the same period.
+    """
+    duplicates = (
+        "SELECT id FROM periods WHERE id NOT IN "
+        '(SELECT MIN(id) FROM periods GROUP BY start, "end")'
+    )
+    for table in ("energy_types", "generations", "period_generation"):
+        connection.exec_driver_sql(
+            f"DELETE FROM {table} WHERE period_id IN ({duplicates})"
+        )
+    connection.exec_driver_sql(f"DELETE FROM periods WHERE id IN ({duplicates})")
+
+
+def _add_missing_columns(connection):
+    """Add model columns that tables created by older versions lack."""
+    for table in Base.metadata.sorted_tables:
+        existing = {
+            row[1]
+            for row in connection.exec_driver_sql(f'PRAGMA table_info("{table.name}")')
+        }
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            column_type = column.type.compile(dialect=connection.dialect)
+            connection.exec_driver_sql(
+                f'ALTER TABLE "{table.name}" ADD COLUMN "{column.name}" {column_type}'
+            )
+
+
+def _rename_prediction_flag(connection):
+    """Move weather.preiction, from older versions, into weather.prediction."""
+    columns = {
+        row[1] for row in connection.exec_driver_sql('PRAGMA table_info("weather")')
+    }
+    if "preiction" in columns:
+        connection.exec_driver_sql(
+            "UPDATE weather SET prediction = preiction WHERE prediction IS NULL"
+        )
+        connection.exec_driver_sql("ALTER TABLE weather DROP COLUMN preiction")
+    # Hours stored before the flag was kept were all observed
+    connection.exec_driver_sql(
+        "UPDATE weather SET prediction = 0 WHERE prediction IS NULL"
+    )
+
+
+def _drop_archive_prune_flag(connection):
+    """Drop archived_months.pruned; archived rows are no longer deleted."""
+    columns = {
+        row[1]
+        for row in connection.exec_driver_sql('PRAGMA table_info("archived_months")')
+    }
+    if "pruned" in columns:
+        connection.exec_driver_sql("ALTER TABLE archived_months DROP COLUMN pruned")
+
+
+def _populate_period_generation(connection):
+    """Pivot energy_types into period_generation for periods lacking a row.
+
+    Like load_rows, the lowest id wins when a period has a fuel twice.
+    """
+    names = ", ".join(f"'{name}'" for name in FUEL_COLUMNS)
+    pivot = ", ".join(
+        f"MAX(CASE WHEN e.type_name = '{name}' THEN e.total END)"
+        for name in FUEL_COLUMNS
+    )
+    connection.exec_driver_sql(f"""
+        INSERT INTO period_generation
+            (period_id, start, {", ".join(FUEL_COLUMNS.values())}, other)
+        SELECT p.id, p.start, {pivot},
+            NULLIF(
+                json_group_object(e.type_name, e.total)
+                    FILTER (WHERE e.type_name NOT IN ({names})),
+                '{{}}'
+            )
+        FROM periods p
+        LEFT JOIN energy_types e ON e.period_id = p.id AND e.id IN (
+            SELECT MIN(id) FROM energy_types GROUP BY period_id, type_name
+        )
+        WHERE p.id NOT IN (SELECT period_id FROM period_generation)
+        GROUP BY p.id
+        """)
+
+
+def _populate_correlation_stats(connection):
+    from ..reports.correlation import rebuild_stats
+
+    if connection.exec_driver_sql("SELECT 1 FROM correlation_stats LIMIT 1").first():
+        return
+    rebuild_stats(connection.connection.driver_connection)
+
+
+def _populate_rollups(connection):
+    if connection.exec_driver_sql("SELECT 1 FROM carbon_rollups LIMIT 1").first():
+        return
+    rebuild_rollups(connection)
+
+
+def migrate(engine=engine):
+    """Bring an existing database up to the current schema.
+
+    create_all only creates missing tables, so columns and indexes added to
+    tables that already exist are created here. Safe to run repeatedly.
+    """
+    Base.metadata.create_all(engine)
+    with engine.begin() as connection:
+        _add_missing_columns(connection)
+        _rename_prediction_flag(connection)
+        _drop_archive_prune_flag(connection)
+        _dedupe_periods(connection)
+        for table in Base.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(connection, checkfirst=True)
+        _populate_period_generation(connection)
+        _populate_correlation_stats(connection)
+        _populate_rollups(connection)
+        # refresh the planner statistics for the new indexes
+        connection.exec_driver_sql("ANALYZE")
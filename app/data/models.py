@@ -3,8 +3,10 @@ from sqlalchemy import (
     Integer,
     Float,
     String,
+    Date,
     DateTime,
     ForeignKey,
+    Index,
     UniqueConstraint,
 )
 from sqlalchemy.orm import relationship
@@ -19,12 +21,12 @@ import datetime
 # Define the Period model
 class Period(Base):
     __tablename__ = "periods"
+    __table_args__ = (Index("uix_start_end", "start", "end", unique=True),)
     id = Column(Integer, primary_key=True)
     start = Column(DateTime, nullable=False)
     end = Column(DateTime, nullable=False)
     carbon_intensity = Column(Float)
     settlement_period = Column(Integer)
-    UniqueConstraint("start", "end", name="uix_start_end")
     generation = relationship("Generation", back_populates="period", uselist=False)
     energy_types = relationship("EnergyType", back_populates="period")
 
@@ -41,6 +43,7 @@ class Period(Base):
 # Define the Generation model
 class Generation(Base):
     __tablename__ = "generations"
+    __table_args__ = (Index("ix_generations_period_id", "period_id"),)
     id = Column(Integer, primary_key=True)
     period_id = Column(Integer, ForeignKey("periods.id"))
     total = Column(Float)
@@ -58,6 +61,12 @@ class Generation(Base):
 
 class EnergyType(Base):
     __tablename__ = "energy_types"
+    __table_args__ = (
+        # covers the period joins without touching the table rows
+        Index("ix_energy_types_period_type_total", "period_id", "type_name", "total"),
+        # covers the energy mix GROUP BY type_name
+        Index("ix_energy_types_type_total", "type_name", "total"),
+    )
     id = Column(Integer, primary_key=True)
     period_id = Column(Integer, ForeignKey("periods.id"))
     type_name = Column(String)
@@ -78,13 +87,53 @@ class EnergyType(Base):
         ]
 
 
+# Fuels with a column of their own in period_generation, by API type name
+FUEL_COLUMNS = {
+    "Biomass": "biomass",
+    "Coal": "coal",
+    "Gas": "gas",
+    "Hydro": "hydro",
+    "Imports": "imports",
+    "Misc": "misc",
+    "Nuclear": "nuclear",
+    "PSH": "psh",
+    "Solar": "solar",
+    "Wind": "wind",
+}
+
+
+class PeriodGeneration(Base):
+    """Generation per fuel for one period, one column per fuel.
+
+    The wide counterpart of energy_types: one row per period instead of one
+    per (period, fuel). Fuels outside FUEL_COLUMNS go into `other`, a JSON
+    object of type name to total.
+    """
+
+    __tablename__ = "period_generation"
+    __table_args__ = (Index("ix_period_generation_start", "start"),)
+    period_id = Column(Integer, ForeignKey("periods.id"), primary_key=True)
+    start = Column(DateTime, nullable=False)
+    biomass = Column(Float)
+    coal = Column(Float)
+    gas = Column(Float)
+    hydro = Column(Float)
+    imports = Column(Float)
+    misc = Column(Float)
+    nuclear = Column(Float)
+    psh = Column(Float)
+    solar = Column(Float)
+    wind = Column(Float)
+    other = Column(String)
+
+
 class Weather(Base):
     __tablename__ = "weather"
     id = Column(Integer, primary_key=True)
     time_epoch = Column(Integer)
     time = Column(DateTime, unique=True)
-    # add a prediction column defult to default to 0
-    preiction = Column(Integer, default=0)
+    # 1 for forecast hours, 0 for observed ones
+    prediction = Column(Integer, default=0)
     temp_c = Column(Float)
     temp_f = Column(Float)
     is_day = Column(Integer)
@@ -124,6 +173,7 @@ class Weather(Base):
         return cls(
             time_epoch=data["time_epoch"],
             time=datetime.datetime.strptime(data["time"], "%Y-%m-%d %H:%M"),
+            prediction=data.get("prediction", 0),
             temp_c=data["temp_c"],
             temp_f=data["temp_f"],
             is_day=data["is_day"],
@@ -158,3 +208,117 @@ class Weather(Base):
             gust_kph=data["gust_kph"],
             uv=data["uv"],
         )
+
+
+class BackfillCheckpoint(Base):
+    __tablename__ = "backfill_checkpoints"
+    __table_args__ = (
+        UniqueConstraint("job", "chunk_start", "chunk_end", name="uix_job_chunk"),
+    )
+    id = Column(Integer, primary_key=True)
+    job = Column(String, nullable=False)
+    chunk_start = Column(DateTime, nullable=False)
+    chunk_end = Column(DateTime, nullable=False)
+    rows = Column(Integer)
+    completed_at = Column(DateTime, default=datetime.datetime.utcnow)
+
+
+class DataVersion(Base):
+    __tablename__ = "data_version"
+    id = Column(Integer, primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow)
+
+
+class DataChange(Base):
+    """The earliest time a data version touched in a table.
+
+    table_name "*" with no `since` marks a version whose changes are unknown.
+    """
+
+    __tablename__ = "data_changes"
+    version = Column(Integer, primary_key=True)
+    table_name = Column(String, primary_key=True)
+    since = Column(DateTime)
+
+
+class CorrelationStat(Base):
+    """Daily sufficient statistics for one (weather variable, energy type) pair.
+
+    Stored as counts and raw sums so any range of days merges with SUM().
+    """
+
+    __tablename__ = "correlation_stats"
+    day = Column(Date, primary_key=True)
+    weather_variable = Column(String, primary_key=True)
+    energy_type = Column(String, primary_key=True)
+    n = Column(Float, nullable=False)
+    sum_x = Column(Float, nullable=False)
+    sum_y = Column(Float, nullable=False)
+    sum_xx = Column(Float, nullable=False)
+    sum_yy = Column(Float, nullable=False)
+    sum_xy = Column(Float, nullable=False)
+
+
+class EnergyRollup(Base):
+    """Generation per energy type summed into hour, day or month buckets."""
+
+    __tablename__ = "energy_rollups"
+    resolution = Column(String, primary_key=True)
+    bucket = Column(DateTime, primary_key=True)
+    type_name = Column(String, primary_key=True)
+    total = Column(Float)
+    periods = Column(Integer)
+
+
+class CarbonRollup(Base):
+    """Carbon intensity mean/min/max over hour, day or month buckets."""
+
+    __tablename__ = "carbon_rollups"
+    resolution = Column(String, primary_key=True)
+    bucket = Column(DateTime, primary_key=True)
+    mean_intensity = Column(Float)
+    min_intensity = Column(Float)
+    max_intensity = Column(Float)
+    periods = Column(Integer)
+
+
+class ArchivedMonth(Base):
+    """A calendar month of one dataset that has been written to Parquet."""
+
+    __tablename__ = "archived_months"
+    dataset = Column(String, primary_key=True)
+    month = Column(String, primary_key=True)  # YYYY-MM
+    rows = Column(Integer, nullable=False)
+    archived_at = Column(DateTime, default=datetime.datetime.utcnow)
+    # Data version the file was written at; see archive.archived_months
+    version = Column(Integer)
+
+
+class HighWaterMark(Base):
+    """Start of the latest period a polling job has loaded."""
+
+    __tablename__ = "high_water_marks"
+    job = Column(String, primary_key=True)
+    mark = Column(DateTime, nullable=False)
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow)
+
+
+class WeatherForecast(Base):
+    """One vintage of a forecast hour, kept for forecast-vs-actual analysis."""
+
+    __tablename__ = "weather_forecasts"
+    __table_args__ = (
+        UniqueConstraint("time", "fetched_at", name="uix_time_fetched_at"),
+    )
+    id = Column(Integer, primary_key=True)
+    time = Column(DateTime, nullable=False)
+    fetched_at = Column(DateTime, nullable=False)
+    temp_c = Column(Float)
+    wind_mph = Column(Float)
+    wind_degree = Column(Integer)
+    humidity = Column(Integer)
+    precip_mm = Column(Float)
+    cloud = Column(Integer)
+    chance_of_rain = Column(Integer)
+    uv = Column(Float)
@@ -0,0 +1,144 @@
+"""Cache for serialized dashboard responses.
+
+Values are stored as JSON text under a key built from the response name, its
+parameters and the data version, so a new ETL load invalidates everything
+without any explicit purge. Entries also expire after a TTL and the store is
+bounded.
+
+The default backend lives in the process. Setting RESPONSE_CACHE_PATH
+switches to a directory on disk that several gunicorn workers can share.
+Concurrent requests for the same key in one process compute it once.
+"""
+
+import collections
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+from . import metrics
+
+TTL = int(os.environ.get("RESPONSE_CACHE_TTL", 30 * 60))
+MAX_ENTRIES = int(os.environ.get("RESPONSE_CACHE_ENTRIES", 256))
+
+
+class MemoryBackend:
+    """LRU of up to `max_entries` values, each kept for `ttl` seconds."""
+
+    def __init__(self, max_entries=MAX_ENTRIES, ttl=TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            stored_at, value = entry
+            if time.monotonic() - stored_at > self.ttl:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+class DiskBackend:
+    """One file per value in `path`, shared between processes.
+
+    Files older than `ttl` are misses; beyond `max_entries` files the least
+    recently used are removed.
+    """
+
+    def __init__(self, path, max_entries=MAX_ENTRIES, ttl=TTL):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        os.makedirs(path, exist_ok=True)
+
+    def get(self, key):
+        path = os.path.join(self.path, key)
+        try:
+            if time.time() - os.path.getmtime(path) > self.ttl:
+                return None
+            with open(path) as f:
+                value = f.read()
+        except OSError:
+            return None
+        # Record the read in the access time for LRU eviction; the mtime
+        # keeps the write time for the TTL
+        os.utime(path, (time.time(), os.path.getmtime(path)))
+        return value
+
+    def set(self, key, value):
+        fd, tmp = tempfile.mkstemp(dir=self.path, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            f.write(value)
+        os.replace(tmp, os.path.join(self.path, key))
+        self._evict()
+
+    def _evict(self):
+        entries = [
+            (entry.stat().st_atime, entry.path)
+            for entry in os.scandir(self.path)
+            if not entry.name.endswith(".tmp")
+        ]
+        for _, path in sorted(entries)[: max(len(entries) - self.max_entries, 0)]:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+class ResponseCache:
+    """Memoizes JSON-serializable responses per (name, params, version).
+
+    `encoder` is the json.JSONEncoder class used to serialize values, e.g.
+    plotly's PlotlyJSONEncoder for figures. Cached values come back as
+    decoded JSON.
+    """
+
+    def __init__(self, backend=None, encoder=None):
+        self.backend = backend or MemoryBackend()
+        self.encoder = encoder
+        self.hits = 0
+        self.misses = 0
+        # Striped so concurrent requests for one key compute it once
+        self._locks = [threading.Lock() for _ in range(64)]
+
+    @classmethod
+    def from_env(cls, encoder=None):
+        path = os.environ.get("RESPONSE_CACHE_PATH")
+        return cls(DiskBackend(path) if path else MemoryBackend(), encoder)
+
+    def key(self, name, params, version):
+        raw = json.dumps([name, params, version], default=str)
+        return hashlib.sha256(raw.encode()).hexdigest()
+
+    def get_or_compute(self, name, params, version, compute):
+        """Return the cached value, calling `compute()` on a miss."""
+        key = self.key(name, params, version)
+        value = self.backend.get(key)
+        if value is None:
+            with self._locks[int(key[:8], 16) % len(self._locks)]:
+                # Another request may have filled it while we waited
+                value = self.backend.get(key)
+                if value is None:
+                    self.misses += 1
+                    result = compute()
+                    with metrics.stage("serialize"):
+                        value = json.dumps(result, cls=self.encoder)
+                    self.backend.set(key, value)
+                    return json.loads(value)
+        self.hits += 1
+        return json.loads(value)
@@ -0,0 +1,118 @@
+import datetime
+
+from sqlalchemy import text
+
+# SQLAlchemy's SQLite DateTime storage format, so buckets read back as datetimes
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S.%f"
+
+# strftime patterns that truncate a stored timestamp to its bucket
+BUCKET_FORMATS = {
+    "hour": "%Y-%m-%d %H:00:00.000000",
+    "day": "%Y-%m-%d 00:00:00.000000",
+    "month": "%Y-%m-01 00:00:00.000000",
+}
+
+# Widest bucket of each resolution, coarsest first
+BUCKET_SIZES = {
+    "month": datetime.timedelta(days=31),
+    "day": datetime.timedelta(days=1),
+    "hour": datetime.timedelta(hours=1),
+}
+
+
+def floor(when, resolution):
+    when = when.replace(minute=0, second=0, microsecond=0)
+    if resolution in ("day", "month"):
+        when = when.replace(hour=0)
+    if resolution == "month":
+        when = when.replace(day=1)
+    return when
+
+
+def next_bucket(bucket, resolution):
+    if resolution == "month":
+        return (bucket.replace(day=28) + datetime.timedelta(days=4)).replace(day=1)
+    return bucket + BUCKET_SIZES[resolution]
+
+
+def choose_resolution(start=None, end=None, resolution=None):
+    """Coarsest rollup that can answer a [start, end) query.
+
+    Both bounds must fall on bucket boundaries and the buckets must be no
+    wider than `resolution` (a timedelta). Returns None when only the raw
+    periods will do.
+    """
+    for name, size in BUCKET_SIZES.items():
+        if resolution is not None and size > resolution:
+            continue
+        if all(bound is None or floor(bound, name) == bound for bound in (start, end)):
+            return name
+    return None
+
+
+def refresh_rollups(connection, first_start, last_start):
+    """Recompute every rollup bucket touching periods in [first_start, last_start].
+
+    Runs on the caller's connection and transaction.
+    """
+    for resolution, bucket_format in BUCKET_FORMATS.items():
+        params = {
+            "resolution": resolution,
+            "bucket_format": bucket_format,
+            "low": floor(first_start, resolution).strftime(TIME_FORMAT),
+            "high": next_bucket(floor(last_start, resolution), resolution).strftime(
+                TIME_FORMAT
+            ),
+        }
+        connection.execute(
+            text(
+                "DELETE FROM energy_rollups WHERE resolution = :resolution "
+                "AND bucket >= :low AND bucket < :high"
+            ),
+            params,
+        )
+        connection.execute(
+            text("""
+                INSERT INTO energy_rollups (resolution, bucket, type_name, total, periods)
+                SELECT :resolution, strftime(:bucket_format, p.start) AS bucket,
+                    e.type_name, SUM(e.total), COUNT(*)
+                FROM periods p
+                JOIN energy_types e ON e.period_id = p.id
+                WHERE p.start >= :low AND p.start < :high
+                GROUP BY bucket, e.type_name
+                """),
+            params,
+        )
+        connection.execute(
+            text(
+                "DELETE FROM carbon_rollups WHERE resolution = :resolution "
+                "AND bucket >= :low AND bucket < :high"
+            ),
+            params,
+        )
+        connection.execute(
+            text("""
+                INSERT INTO carbon_rollups (resolution, bucket, mean_intensity,
+                    min_intensity, max_intensity, periods)
+                SELECT :resolution, strftime(:bucket_format, start) AS bucket,
+                    AVG(carbon_intensity), MIN(carbon_intensity),
+                    MAX(carbon_intensity), COUNT(carbon_intensity)
+                FROM periods
+                WHERE start >= :low AND start < :high
+                GROUP BY bucket
+                """),
+            params,
+        )
+
+
+def rebuild_rollups(connection):
+    """Recompute the rollups for every stored period."""
+    first, last = connection.execute(
+        text("SELECT MIN(start), MAX(start) FROM periods")
+    ).one()
+    if first is not None:
+        refresh_rollups(
+            connection,
+            datetime.datetime.fromisoformat(first),
+            datetime.datetime.fromisoformat(last),
+        )
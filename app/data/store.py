@@ -0,0 +1,236 @@
+"""Memory-resident time series for the dashboard.
+
+Each series keeps its timestamps as uint32 epoch seconds and each value
+column as float32, in contiguous arrays sorted by time: 8 bytes per carbon
+intensity point and 28 per weather hour. Ranges are found with a binary
+search and returned as DataFrames whose value columns are views of the
+arrays; only the times are converted, to datetime64. The dashboard hands
+these frames to Plotly as they are.
+
+The store loads every series on first use. After that refresh() only acts
+when the data version has moved. It then re-reads each changed series from
+the earliest time the loaders recorded in data_changes, which covers
+backfills and revisions as well as new rows, or reloads it entirely when
+the log doesn't reach back to the store's version. Once months are
+archived, loads read them from the Parquet archive instead of the tables.
+
+A refresh builds new arrays and swaps each Series in whole, so readers take
+a consistent snapshot without locking.
+"""
+
+import datetime
+import threading
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+
+from . import archive
+from .downsample import lttb_indices
+from .version import get_changes, get_data_version
+
+# Table, time column and value columns of each series
+SERIES = {
+    "carbon": ("periods", "start", ["carbon_intensity"]),
+    "weather": (
+        "weather",
+        "time",
+        ["temp_c", "wind_mph", "pressure_mb", "humidity", "gust_mph", "prediction"],
+    ),
+}
+
+EPOCH = datetime.datetime(1970, 1, 1)
+
+
+def _epoch(value):
+    return int((value - EPOCH).total_seconds())
+
+
+def _frame(time_column, times, columns):
+    """A DataFrame of `times` as datetime64 and the `columns` arrays, uncopied."""
+    return pd.DataFrame(
+        {time_column: times.astype("datetime64[s]"), **columns}, copy=False
+    )
+
+
+class Series:
+    """Time-ordered arrays that are never modified once built."""
+
+    def __init__(self, columns, times=None, values=None):
+        self.columns = columns
+        self.times = np.empty(0, dtype=np.uint32) if times is None else times
+        self._values = values or {
+            column: np.empty(0, dtype=np.float32) for column in columns
+        }
+
+    @property
+    def size(self):
+        return len(self.times)
+
+    def values(self, column):
+        return self._values[column]
+
+    def nbytes(self):
+        return self.size * (4 + 4 * len(self.columns))
+
+    def replace_from(self, since, times, values):
+        """A copy with the points at or after `since` replaced by the given ones."""
+        keep = int(np.searchsorted(self.times, since, side="left"))
+        return Series(
+            self.columns,
+            np.concatenate([self.times[:keep], times.astype(np.uint32)]),
+            {
+                column: np.concatenate(
+                    [self._values[column][:keep], values[column].astype(np.float32)]
+                )
+                for column in self.columns
+            },
+        )
+
+    def slice(self, start=None, end=None):
+        """(first, last) positions of the points with times in [start, end)."""
+        times = self.times
+        first = 0 if start is None else np.searchsorted(times, _epoch(start))
+        last = len(times) if end is None else np.searchsorted(times, _epoch(end))
+        return int(first), int(last)
+
+
+class TimeSeriesStore:
+    def __init__(self):
+        self.series = {
+            name: Series(columns) for name, (_, _, columns) in SERIES.items()
+        }
+        self.version = None
+        self._lock = threading.Lock()
+
+    def _read(self, connection, name, since):
+        """Epoch seconds and values of a series from `since` on.
+
+        Archived months are read from Parquet, only the series' columns.
+        """
+        table, time_column, columns = SERIES[name]
+        low = EPOCH + datetime.timedelta(seconds=since)
+        if archive.pa is not None and archive.archived_months(connection, table):
+            data = archive.read_table(connection, table, [time_column, *columns], low)
+            times = data.column(time_column).to_numpy().astype("datetime64[s]")
+            return times.astype(np.int64), {
+                column: data.column(column)
+                .cast(archive.pa.float64())
+                .to_numpy(zero_copy_only=False)
+                for column in columns
+            }
+
+        rows = connection.execute(
+            text(
+                f"SELECT CAST(strftime('%s', {time_column}) AS INTEGER), "
+                f"{', '.join(columns)} FROM {table} "
+                f"WHERE {time_column} >= :since ORDER BY {time_column}"
+            ),
+            {"since": low},
+        ).all()
+        data = np.array(rows, dtype=np.float64).reshape(len(rows), len(columns) + 1)
+        times = data[:, 0].astype(np.uint32)
+        return times, {column: data[:, i + 1] for i, column in enumerate(columns)}
+
+    def refresh(self, session):
+        """Bring the store up to date with the database. Cheap when idle."""
+        version = get_data_version(session)
+        if version == self.version:
+            return
+        with self._lock:
+            if version == self.version:
+                return
+            changes = None
+            if self.version is not None:
+                changes = get_changes(session, self.version, version)
+            connection = session.connection()
+            for name, series in self.series.items():
+                table = SERIES[name][0]
+                since = 0
+                if changes is not None:
+                    if table not in changes:
+                        continue
+                    since = max(_epoch(changes[table]), 0)
+                times, values = self._read(connection, name, since)
+                self.series[name] = series.replace_from(since, times, values)
+            self.version = version
+
+    def nbytes(self):
+        return sum(series.nbytes() for series in self.series.values())
+
+    def carbon_intensity(self, start=None, end=None, points=None):
+        """Carbon intensity in [start, end), downsampled to `points` by LTTB."""
+        series = self.series["carbon"]
+        first, last = series.slice(start, end)
+        times = series.times[first:last]
+        values = series.values("carbon_intensity")[first:last]
+
+        missing = np.isnan(values)
+        if missing.any():
+            times, values = times[~missing], values[~missing]
+        if points:
+            kept = lttb_indices(times, values, points)
+            times, values = times[kept], values[kept]
+        return _frame("start", times, {"carbon_intensity": values})
+
+    def _weather(self, first, last, columns, observed):
+        """Times and `columns` of the weather points in [first, last).
+
+        With `observed` forecast hours are dropped, which copies the arrays.
+        """
+        series = self.series["weather"]
+        times = series.times[first:last]
+        values = {column: series.values(column)[first:last] for column in columns}
+        if observed:
+            kept = series.values("prediction")[first:last] == 0
+            times = times[kept]
+            values = {column: value[kept] for column, value in values.items()}
+        return times, values
+
+    def weather(self, start=None, end=None, points=None, observed=False):
+        """Weather averaged into at most `points` equal time buckets.
+
+        Has the columns of DataAccessLayer.get_weather with `points`; wind_dir
+        is None. With `observed` forecast hours are left out.
+        """
+        columns = [c for c in SERIES["weather"][2] if c != "prediction"]
+        times, values = self._weather(
+            *self.series["weather"].slice(start, end), columns, observed
+        )
+        if not len(times):
+            return _frame("time", times, {"wind_dir": None, **values})
+        span_start = _epoch(start) if start else int(times[0])
+        span_end = _epoch(end) if end else int(times[-1])
+        width = max(int((span_end - span_start) / points) + 1, 1)
+        buckets = (times.astype(np.int64) - span_start) // width
+        # Buckets are in time order, so each one is a contiguous run
+        starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+
+        def mean(values):
+            values = values.astype(np.float64)
+            present = ~np.isnan(values)
+            sums = np.add.reduceat(np.where(present, values, 0), starts)
+            n = np.add.reduceat(present.astype(np.int64), starts)
+            with np.errstate(invalid="ignore", divide="ignore"):
+                return sums / n
+
+        means = {column: mean(value) for column, value in values.items()}
+        return _frame("time", times[starts], {"wind_dir": None, **means})
+
+    def points_after(self, name, after, fields, observed=False):
+        """Points of a series with times after `after`, oldest first; all if None.
+
+        A DataFrame with `fields` as columns: the time first, then the value
+        columns to include. With `observed` weather forecast hours are left
+        out.
+        """
+        series = self.series[name]
+        first = 0
+        if after is not None:
+            first = int(np.searchsorted(series.times, _epoch(after), side="right"))
+        if observed:
+            times, values = self._weather(first, series.size, fields[1:], True)
+        else:
+            times = series.times[first:]
+            values = {field: series.values(field)[first:] for field in fields[1:]}
+        return _frame(fields[0], times, values)
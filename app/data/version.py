@@ -0,0 +1,64 @@
+import datetime
+
+from sqlalchemy import delete, func
+
+from .models import DataChange, DataVersion
+
+# Versions kept in data_changes; readers further behind reload everything
+CHANGE_LOG_LENGTH = 1000
+
+
+def bump_data_version(session, changed=None):
+    """Mark the stored data as changed so cached reports get recomputed.
+
+    `changed` maps each table written to the earliest time written in it,
+    which lets TimeSeriesStore re-read only from there. Without it, readers
+    assume everything changed. Call inside the loading transaction, before
+    it commits.
+    """
+    marker = session.get(DataVersion, 1)
+    if marker is None:
+        marker = DataVersion(id=1, version=1)
+        session.add(marker)
+    else:
+        marker.version += 1
+        marker.updated_at = datetime.datetime.utcnow()
+
+    session.add_all(
+        DataChange(version=marker.version, table_name=table, since=since)
+        for table, since in (changed or {"*": None}).items()
+    )
+    session.execute(
+        delete(DataChange).where(
+            DataChange.version <= marker.version - CHANGE_LOG_LENGTH
+        )
+    )
+    session.flush()
+
+
+def get_data_version(session):
+    marker = session.get(DataVersion, 1)
+    return marker.version if marker else 0
+
+
+def get_changes(session, after, upto):
+    """Earliest time touched per table by versions in (after, upto].
+
+    Returns None when the log can't say, because it was trimmed or a version
+    didn't record its changes; the caller should then reload everything.
+    """
+    if upto <= after:
+        return None
+    in_range = (DataChange.version > after) & (DataChange.version <= upto)
+    logged = session.query(func.count(func.distinct(DataChange.version))).filter(
+        in_range
+    )
+    if logged.scalar() != upto - after:
+        return None
+    changes = dict(
+        session.query(DataChange.table_name, func.min(DataChange.since))
+        .filter(in_range)
+        .group_by(DataChange.table_name)
+        .all()
+    )
+    return None if "*" in changes else changes
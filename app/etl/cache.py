@@ -0,0 +1,153 @@
+"""On-disk HTTP cache for the ETL extractors.
+
+Responses are stored under HTTP_CACHE_PATH, one body and one metadata file
+per URL and query. Repeat requests send If-None-Match/If-Modified-Since
+and reuse the stored body on a 304.
+
+The cache also remembers a digest of the last payload each job finished
+loading, so a poll that returns the same data can skip transform and load:
+
+    response = cache.get(url)
+    if not cache.seen(response):
+        load(response.json())
+        cache.mark_seen(response)
+"""
+
+import hashlib
+import json
+import logging
+import os
+import tempfile
+
+from .http import make_session
+
+logger = logging.getLogger(__name__)
+
+CACHE_PATH = os.environ.get("HTTP_CACHE_PATH", ".http_cache")
+
+# Least recently used bodies are evicted beyond this many bytes
+MAX_BYTES = 64 * 1024 * 1024
+
+
+def _digest(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def _write_atomic(path, data):
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+    with os.fdopen(fd, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+class CachedResponse:
+    def __init__(self, key, body, not_modified):
+        self.key = key
+        self.body = body
+        self.not_modified = not_modified
+        self.digest = _digest(body)
+
+    def json(self):
+        return json.loads(self.body)
+
+
+class HttpCache:
+    def __init__(self, path=CACHE_PATH, max_bytes=MAX_BYTES, session=None):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.session = session or make_session()
+        os.makedirs(path, exist_ok=True)
+
+    def _key(self, url, params):
+        query = json.dumps(sorted((params or {}).items()), default=str)
+        return _digest(f"{url}?{query}".encode())
+
+    def _files(self, key):
+        base = os.path.join(self.path, key)
+        return base + ".body", base + ".meta"
+
+    def _read_meta(self, key):
+        try:
+            with open(self._files(key)[1]) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _write_meta(self, key, meta):
+        _write_atomic(self._files(key)[1], json.dumps(meta).encode())
+
+    def get(self, url, params=None):
+        """GET `url`, revalidating against the cached copy when there is one.
+
+        Raises for error statuses, like response.raise_for_status().
+        """
+        key = self._key(url, params)
+        body_path, _ = self._files(key)
+        meta = self._read_meta(key)
+
+        headers = {}
+        if os.path.exists(body_path):
+            if meta.get("etag"):
+                headers["If-None-Match"] = meta["etag"]
+            if meta.get("last_modified"):
+                headers["If-Modified-Since"] = meta["last_modified"]
+
+        response = self.session.get(url, params=params, headers=headers)
+        if response.status_code == 304 and headers:
+            with open(body_path, "rb") as f:
+                body = f.read()
+            # Touch the body so eviction sees it as recently used
+            os.utime(body_path)
+            logger.info("%s not modified; using the cached copy", url)
+            return CachedResponse(key, body, not_modified=True)
+
+        response.raise_for_status()
+        body = response.content
+        _write_atomic(body_path, body)
+        meta.update(
+            url=url,
+            etag=response.headers.get("ETag"),
+            last_modified=response.headers.get("Last-Modified"),
+        )
+        self._write_meta(key, meta)
+        self._evict()
+        return CachedResponse(key, body, not_modified=False)
+
+    def _payload_digest(self, response, payload):
+        if payload is None:
+            return response.digest
+        return _digest(json.dumps(payload, sort_keys=True, default=str).encode())
+
+    def seen(self, response, payload=None):
+        """True if this payload was already marked as loaded.
+
+        `payload` narrows the comparison to part of the response, for APIs
+        whose bodies carry a timestamp that changes on every request. The
+        whole body is compared by default.
+        """
+        seen = self._read_meta(response.key).get("seen")
+        return seen == self._payload_digest(response, payload)
+
+    def mark_seen(self, response, payload=None):
+        """Record the payload as loaded; call after the load commits."""
+        meta = self._read_meta(response.key)
+        meta["seen"] = self._payload_digest(response, payload)
+        self._write_meta(response.key, meta)
+
+    def _evict(self):
+        bodies = []
+        for entry in os.scandir(self.path):
+            if entry.name.endswith(".body"):
+                stat = entry.stat()
+                bodies.append((stat.st_mtime, stat.st_size, entry.path))
+
+        total = sum(size for _, size, _ in bodies)
+        for _, size, path in sorted(bodies):
+            if total <= self.max_bytes:
+                break
+            for stale in (path, path[: -len(".body")] + ".meta"):
+                try:
+                    os.remove(stale)
+                except FileNotFoundError:
+                    pass
+            total -= size
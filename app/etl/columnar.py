@@ -0,0 +1,64 @@
+"""Columnar transform for large energy payloads.
+
+Each payload is converted into pandas columns in one pass, with timestamps
+parsed in bulk, and handed to the bulk loader as plain rows without
+building an ORM object per period.
+"""
+
+import pandas as pd
+
+# Payloads with at least this many entries use the columnar transform
+COLUMNAR_THRESHOLD = 500
+
+
+def _records(frame):
+    """Frame rows as dicts, with missing values as None."""
+    frame = frame.astype(object).where(frame.notna(), None)
+    return frame.to_dict("records")
+
+
+def _timestamps(values):
+    # Drop any UTC offset and keep the wall-clock time, as the ORM path's
+    # replace(tzinfo=None) does
+    naive = values.str.replace(r"(Z|[+-]\d{2}:?\d{2})$", "", regex=True)
+    return pd.to_datetime(naive, format="ISO8601").dt.to_pydatetime()
+
+
+def transform_energy(half_hourly_data):
+    """Transform halfHourlyData into (period_rows, energy_rows) for load_rows.
+
+    generationValues is flattened to one column per (fuel, field) and
+    stacked into long format, one row per period and fuel.
+    """
+    flat = pd.json_normalize(half_hourly_data, sep="|")
+    starts = _timestamps(flat["start"])
+    ends = _timestamps(flat["end"])
+
+    periods = pd.DataFrame(
+        {
+            "start": starts,
+            "end": ends,
+            "carbon_intensity": flat.get("carbonIntensity"),
+            "settlement_period": flat.get("settlementPeriod"),
+            "generation_total": flat.get("generationTotal"),
+        }
+    )
+
+    value_columns = [c for c in flat.columns if c.startswith("generationValues|")]
+    values = flat[value_columns]
+    values.columns = pd.MultiIndex.from_tuples(
+        [tuple(column.split("|")[1:]) for column in value_columns],
+        names=["type_name", "field"],
+    )
+    energy = (
+        values.stack(level="type_name", future_stack=True)
+        .dropna(how="all")
+        .reset_index(level="type_name")
+    )
+    energy.insert(0, "start", starts[energy.index])
+    energy.insert(1, "end", ends[energy.index])
+
+    return (
+        _records(periods),
+        _records(energy[["start", "end", "type_name", "total", "percentage"]]),
+    )
@@ -0,0 +1,32 @@
+"""Keep the tables derived from periods and weather in step with each load."""
+
+import datetime
+
+from ..data.rollups import refresh_rollups
+from ..reports.correlation import refresh_stats
+
+
+def refresh_correlation_stats(session, days):
+    """Rebuild the daily correlation statistics for `days` in this transaction."""
+    connection = session.connection().connection.driver_connection
+    refresh_stats(connection, days)
+
+
+def refresh_period_rollups(session, starts):
+    """Recompute the hourly, daily and monthly rollups covering `starts`."""
+    starts = list(starts)
+    if starts:
+        refresh_rollups(session.connection(), min(starts), max(starts))
+
+
+def weather_days(times):
+    """Days whose periods may pair with weather at `times`.
+
+    A period just before midnight can pair with the first hour of the next
+    day, so the previous day is included as well.
+    """
+    days = set()
+    for time in times:
+        days.add(time.date())
+        days.add(time.date() - datetime.timedelta(days=1))
+    return days
@@ -1,10 +1,29 @@
+import datetime
+import json
 import requests
 import logging
-from sqlalchemy import and_
+from collections import defaultdict
+from sqlalchemy import insert, update, delete, select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.orm import sessionmaker
 
-from ..data.models import Period, Generation, EnergyType
+import dateutil.parser
+
+from ..data.models import (
+    FUEL_COLUMNS,
+    Period,
+    Generation,
+    EnergyType,
+    HighWaterMark,
+    PeriodGeneration,
+)
+from ..data import metrics
 from ..data.db import engine
+from ..data.version import bump_data_version
+from .derived import refresh_correlation_stats, refresh_period_rollups
+from .cache import HttpCache
+from .columnar import COLUMNAR_THRESHOLD, transform_energy
+from .stream import batched, iter_array
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
@@ -12,6 +31,14 @@ logger = logging.getLogger(__name__)
 
 Session = sessionmaker(bind=engine)
 
+TODAY_URL = "https://www.energydashboard.co.uk/api/today/generation"
+
+# Entries per batch when streaming a response
+BATCH_SIZE = 1000
+
+# Periods this far before the high-water mark are still checked for revisions
+REVISION_WINDOW = datetime.timedelta(hours=2)
+
 
 def extract(url):
     response = requests.get(url)
@@ -19,6 +46,20 @@ def extract(url):
     return data["halfHourlyData"]
 
 
+def extract_batches(url, batch_size=BATCH_SIZE, params=None, session=None):
+    """Stream halfHourlyData from `url` in lists of up to `batch_size`.
+
+    The response is parsed incrementally, so memory is bounded by the batch
+    size rather than the size of the response.
+    """
+    with (session or requests).get(url, params=params, stream=True) as response:
+        response.raise_for_status()
+        entries = iter_array(
+            response.iter_content(chunk_size=64 * 1024), "halfHourlyData"
+        )
+        yield from batched(entries, batch_size)
+
+
 def transform(half_hourly_data):
     transformed_data = []
     for entry in half_hourly_data:
@@ -35,38 +76,399 @@ def transform(half_hourly_data):
     return transformed_data
 
 
+def transform_rows(half_hourly_data):
+    """Rows for load_rows, via the columnar transform for large payloads."""
+    if len(half_hourly_data) >= COLUMNAR_THRESHOLD:
+        return transform_energy(half_hourly_data)
+    return _to_rows(transform(half_hourly_data))
+
+
+def _period_key(start, end):
+    # SQLite stores naive timestamps, so compare on the wall-clock value
+    return start.replace(tzinfo=None), end.replace(tzinfo=None)
+
+
+def _to_rows(transformed_data):
+    """Flatten transformed ORM entries into plain rows for load_rows."""
+    period_rows = []
+    energy_rows = []
+    for entry in transformed_data:
+        period = entry["period"]
+        start, end = _period_key(period.start, period.end)
+        period_rows.append(
+            {
+                "start": start,
+                "end": end,
+                "carbon_intensity": period.carbon_intensity,
+                "settlement_period": period.settlement_period,
+                "generation_total": entry["generation"].total,
+            }
+        )
+        energy_rows.extend(
+            {
+                "start": start,
+                "end": end,
+                "type_name": energy_type.type_name,
+                "total": energy_type.total,
+                "percentage": energy_type.percentage,
+            }
+            for energy_type in entry["energy_types"]
+        )
+    return period_rows, energy_rows
+
+
+def _existing_periods(session, first_start, last_start):
+    rows = session.execute(
+        select(
+            Period.id,
+            Period.start,
+            Period.end,
+            Period.carbon_intensity,
+            Period.settlement_period,
+        ).where(Period.start.between(first_start, last_start))
+    )
+    return {(row.start, row.end): row for row in rows}
+
+
+def _existing_children(session, first_start, last_start):
+    """Generation and energy type rows for the periods in a start range.
+
+    Returns ({period_id: generation}, {period_id: {type_name: energy_type}},
+    ids of duplicate rows). Duplicates were appended by older loaders that
+    re-inserted children on every run.
+    """
+    in_range = Period.start.between(first_start, last_start)
+    generations = {}
+    duplicates = []
+    for row in session.execute(
+        select(Generation.id, Generation.period_id, Generation.total)
+        .join(Period, Generation.period_id == Period.id)
+        .where(in_range)
+        .order_by(Generation.id)
+    ):
+        if row.period_id in generations:
+            duplicates.append((Generation, row.id))
+        else:
+            generations[row.period_id] = row
+
+    energy_types = defaultdict(dict)
+    for row in session.execute(
+        select(
+            EnergyType.id,
+            EnergyType.period_id,
+            EnergyType.type_name,
+            EnergyType.total,
+            EnergyType.percentage,
+        )
+        .join(Period, EnergyType.period_id == Period.id)
+        .where(in_range)
+        .order_by(EnergyType.id)
+    ):
+        if row.type_name in energy_types[row.period_id]:
+            duplicates.append((EnergyType, row.id))
+        else:
+            energy_types[row.period_id][row.type_name] = row
+    return generations, energy_types, duplicates
+
+
+def _period_changed(existing, row, generation, energy_types, energy_rows):
+    if (
+        existing.carbon_intensity != row["carbon_intensity"]
+        or existing.settlement_period != row["settlement_period"]
+        or generation is None
+        or generation.total != row["generation_total"]
+        or len(energy_types) != len(energy_rows)
+    ):
+        return True
+    for energy_row in energy_rows:
+        stored = energy_types.get(energy_row["type_name"])
+        if (
+            stored is None
+            or stored.total != energy_row["total"]
+            or stored.percentage != energy_row["percentage"]
+        ):
+            return True
+    return False
+
+
+def _insert_children(session, keys, existing, periods, energy_by_period):
+    session.execute(
+        insert(Generation),
+        [
+            {"period_id": existing[key].id, "total": periods[key]["generation_total"]}
+            for key in keys
+        ],
+    )
+    energy_values = [
+        {
+            "period_id": existing[key].id,
+            "type_name": row["type_name"],
+            "total": row["total"],
+            "percentage": row["percentage"],
+        }
+        for key in keys
+        for row in energy_by_period[key]
+    ]
+    if energy_values:
+        session.execute(insert(EnergyType), energy_values)
+
+
+def _update_children(
+    session, keys, existing, periods, energy_by_period, generations, energy_types
+):
+    """Bring revised periods' children in line with the payload, in place."""
+    generation_updates = []
+    generation_inserts = []
+    energy_updates = []
+    energy_inserts = []
+    stale_ids = []
+    for key in keys:
+        period_id = existing[key].id
+        total = periods[key]["generation_total"]
+        if period_id in generations:
+            generation_updates.append({"id": generations[period_id].id, "total": total})
+        else:
+            generation_inserts.append({"period_id": period_id, "total": total})
+
+        stored = dict(energy_types.get(period_id, {}))
+        for row in energy_by_period[key]:
+            values = {"total": row["total"], "percentage": row["percentage"]}
+            current = stored.pop(row["type_name"], None)
+            if current is None:
+                energy_inserts.append(
+                    {"period_id": period_id, "type_name": row["type_name"], **values}
+                )
+            elif (current.total, current.percentage) != tuple(values.values()):
+                energy_updates.append({"id": current.id, **values})
+        # Fuels no longer reported for the period
+        stale_ids.extend(row.id for row in stored.values())
+
+    if generation_updates:
+        session.execute(update(Generation), generation_updates)
+    if generation_inserts:
+        session.execute(insert(Generation), generation_inserts)
+    if energy_updates:
+        session.execute(update(EnergyType), energy_updates)
+    if energy_inserts:
+        session.execute(insert(EnergyType), energy_inserts)
+    if stale_ids:
+        session.execute(delete(EnergyType).where(EnergyType.id.in_(stale_ids)))
+
+
+def _period_generation_row(period_id, start, energy_rows):
+    """The period_generation row for one period's energy type rows."""
+    row = {"period_id": period_id, "start": start}
+    row.update(dict.fromkeys(FUEL_COLUMNS.values()))
+    other = {}
+    for energy_row in energy_rows:
+        column = FUEL_COLUMNS.get(energy_row["type_name"])
+        if column:
+            row[column] = energy_row["total"]
+        else:
+            other[energy_row["type_name"]] = energy_row["total"]
+    row["other"] = json.dumps(other, sort_keys=True) if other else None
+    return row
+
+
+def _write_period_generation(session, keys, existing, energy_by_period):
+    """Upsert the wide generation rows of the given periods."""
+    statement = sqlite_insert(PeriodGeneration.__table__)
+    columns = ["start", *FUEL_COLUMNS.values(), "other"]
+    statement = statement.on_conflict_do_update(
+        index_elements=["period_id"],
+        set_={column: statement.excluded[column] for column in columns},
+    )
+    session.execute(
+        statement,
+        [
+            _period_generation_row(existing[key].id, key[0], energy_by_period[key])
+            for key in keys
+        ],
+    )
+
+
+def load_rows(session, period_rows, energy_rows):
+    """Upsert a batch of periods with their generation and energy type rows.
+
+    Existing periods and their children are resolved with range lookups and
+    every table is written with executemany. New periods are inserted;
+    periods whose values were revised are updated in place, including their
+    generation and energy types; unchanged periods are skipped. Energy types
+    are written both as energy_types rows and as the period's wide
+    period_generation row. When anything was written the derived correlation
+    statistics and rollups are refreshed and the data version is bumped. The
+    caller owns the transaction. Returns a dict of inserted/updated/skipped
+    period counts.
+    """
+    periods = {}
+    for row in period_rows:
+        periods[_period_key(row["start"], row["end"])] = row
+    if not periods:
+        return {"inserted": 0, "updated": 0, "skipped": 0}
+
+    energy_by_period = defaultdict(list)
+    for row in energy_rows:
+        energy_by_period[_period_key(row["start"], row["end"])].append(row)
+
+    starts = [start for start, _ in periods]
+    first_start, last_start = min(starts), max(starts)
+    existing = _existing_periods(session, first_start, last_start)
+    generations, energy_types, duplicates = _existing_children(
+        session, first_start, last_start
+    )
+
+    new_keys = [key for key in periods if key not in existing]
+    changed_keys = [
+        key
+        for key in periods
+        if key in existing
+        and _period_changed(
+            existing[key],
+            periods[key],
+            generations.get(existing[key].id),
+            energy_types.get(existing[key].id, {}),
+            energy_by_period[key],
+        )
+    ]
+
+    for model in (Generation, EnergyType):
+        ids = [row_id for table, row_id in duplicates if table is model]
+        if ids:
+            session.execute(delete(model).where(model.id.in_(ids)))
+
+    if new_keys:
+        session.execute(
+            insert(Period),
+            [
+                {
+                    "start": start,
+                    "end": end,
+                    "carbon_intensity": periods[start, end]["carbon_intensity"],
+                    "settlement_period": periods[start, end]["settlement_period"],
+                }
+                for start, end in new_keys
+            ],
+        )
+        # Re-read the window to pick up the ids SQLite assigned
+        existing = _existing_periods(session, first_start, last_start)
+        _insert_children(session, new_keys, existing, periods, energy_by_period)
+
+    if changed_keys:
+        session.execute(
+            update(Period),
+            [
+                {
+                    "id": existing[key].id,
+                    "carbon_intensity": periods[key]["carbon_intensity"],
+                    "settlement_period": periods[key]["settlement_period"],
+                }
+                for key in changed_keys
+            ],
+        )
+        _update_children(
+            session,
+            changed_keys,
+            existing,
+            periods,
+            energy_by_period,
+            generations,
+            energy_types,
+        )
+
+    written_keys = new_keys + changed_keys
+    if written_keys:
+        _write_period_generation(session, written_keys, existing, energy_by_period)
+
+    # Removing duplicates changes the sums for the whole window
+    refreshed = list(periods) if duplicates else written_keys
+    if refreshed:
+        refresh_correlation_stats(session, {start.date() for start, _ in refreshed})
+        refresh_period_rollups(session, [start for start, _ in refreshed])
+        bump_data_version(session, {"periods": min(start for start, _ in refreshed)})
+
+    return {
+        "inserted": len(new_keys),
+        "updated": len(changed_keys),
+        "skipped": len(periods) - len(written_keys),
+    }
+
+
 def load(transformed_data):
+    return load_batch(*_to_rows(transformed_data))
+
+
+def load_batch(period_rows, energy_rows):
     session = Session()
     try:
-        for entry in transformed_data:
-            period = (
-                session.query(Period)
-                .filter(
-                    and_(
-                        Period.start == entry["period"].start,
-                        Period.end == entry["period"].end,
-                    )
-                )
-                .first()
-            )
-            if period is None:
-                period = entry["period"]
-                session.add(period)
-                session.flush()  # This will assign an ID to the period without committing the transaction
-
-            entry["generation"].period = period
-            for energy_type in entry["energy_types"]:
-                energy_type.period = period
-
-            session.add(entry["generation"])
-            session.add_all(entry["energy_types"])
-
-            # Commit the transaction
-            session.commit()
-
-        # Log the number of new rows added
-        new_rows_count = len(session.new)
-        logger.info(f"New rows added: {new_rows_count}")
+        counts = load_rows(session, period_rows, energy_rows)
+        session.commit()
+
+        logger.info(
+            "Periods inserted: %(inserted)s, updated: %(updated)s, "
+            "skipped: %(skipped)s",
+            counts,
+        )
+        return counts
+    except Exception as e:
+        session.rollback()
+        logger.exception("An error occurred while loading data into the database.")
+        raise e
+    finally:
+        session.close()
+
+
+def get_high_water_mark(session, job):
+    marker = session.get(HighWaterMark, job)
+    return marker.mark if marker else None
+
+
+def set_high_water_mark(session, job, mark):
+    marker = session.get(HighWaterMark, job)
+    if marker is None:
+        session.add(HighWaterMark(job=job, mark=mark))
+    elif mark > marker.mark:
+        marker.mark = mark
+        marker.updated_at = datetime.datetime.utcnow()
+
+
+def _entry_start(entry):
+    return dateutil.parser.isoparse(entry["start"]).replace(tzinfo=None)
+
+
+def load_delta(half_hourly_data, job="energy-today"):
+    """Load only the part of a payload at or after the job's high-water mark.
+
+    Entries older than the mark minus REVISION_WINDOW were loaded by an
+    earlier poll and are dropped before transforming. The rest go through
+    load_rows, which writes new periods and updates revised ones in place.
+    The mark then advances to the latest period loaded.
+    """
+    session = Session()
+    try:
+        mark = get_high_water_mark(session, job)
+        if mark is not None:
+            since = mark - REVISION_WINDOW
+            half_hourly_data = [
+                entry for entry in half_hourly_data if _entry_start(entry) >= since
+            ]
+        if not half_hourly_data:
+            return {"inserted": 0, "updated": 0, "skipped": 0}
+
+        with metrics.stage("transform"):
+            rows = transform_rows(half_hourly_data)
+        with metrics.stage("load"):
+            counts = load_rows(session, *rows)
+        set_high_water_mark(
+            session, job, max(_entry_start(entry) for entry in half_hourly_data)
+        )
+        session.commit()
+
+        logger.info(
+            "Periods inserted: %(inserted)s, updated: %(updated)s, "
+            "skipped: %(skipped)s",
+            counts,
+        )
+        return counts
     except Exception as e:
         session.rollback()
         logger.exception("An error occurred while loading data into the database.")
@@ -75,9 +477,21 @@ def load(transformed_data):
         session.close()
 
 
-def run():
-    url = "https://www.energydashboard.co.uk/api/today/generation"
-    data = extract(url)
-    transformed_data = transform(data)
-    load(transformed_data)
+@metrics.timed
+def run(stream=False, url=TODAY_URL, cache=None):
+    if stream:
+        counts = {"inserted": 0, "updated": 0, "skipped": 0}
+        for batch in extract_batches(url):
+            for key, value in load_batch(*transform_rows(batch)).items():
+                counts[key] += value
+    else:
+        cache = cache or HttpCache()
+        with metrics.stage("extract"):
+            response = cache.get(url)
+        if cache.seen(response):
+            logger.info("Generation data unchanged since the last run; skipping.")
+            return {"inserted": 0, "updated": 0, "skipped": 0}
+        counts = load_delta(response.json()["halfHourlyData"])
+        cache.mark_seen(response)
     print("ETL process completed.")
+    return counts
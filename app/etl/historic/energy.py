@@ -1,61 +1,305 @@
 import datetime
-import requests
 import logging
-from sqlalchemy import and_
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from sqlalchemy import func
 from sqlalchemy.orm import sessionmaker
 
-import json
-
-from ...data.models import Period, Generation, EnergyType
+from ...data.models import Period, BackfillCheckpoint
+from ...data import metrics
 from ...data.db import Base, engine
+from ..energy import BATCH_SIZE, extract_batches, transform_rows, load_rows
+from ..http import make_session
+from ..pipeline import run_pipeline
 
+logger = logging.getLogger(__name__)
 
-def get_history(days: int):
+BASE_URL = "https://www.energydashboard.co.uk/api/historical/generation"
+
+# Chunk boundaries are whole multiples of chunk_days from here
+CHUNK_EPOCH = datetime.datetime(1970, 1, 1)
+
+GROUP_SIZES = {
+    "30m": datetime.timedelta(minutes=30),
+    "1h": datetime.timedelta(hours=1),
+    "1d": datetime.timedelta(days=1),
+}
+
+
+def fetch_range(from_date, to_date, group_by="1d", base_url=BASE_URL, session=None):
     # https://www.energydashboard.co.uk/api/historical/generation?from_date=2023-08-10T23:00:00Z&to_date=2023-11-08T23:59:59Z&group_by=1d
+    session = session or make_session()
 
-    base_url = "https://www.energydashboard.co.uk/api/historical/generation"
+    response = session.get(base_url, params=_params(from_date, to_date, group_by))
+    response.raise_for_status()
+    return response.json()
 
-    today = datetime.datetime.now()
 
-    from_date = today - datetime.timedelta(days=days)
+def _params(from_date, to_date, group_by):
+    return {
+        "from_date": from_date.strftime("%Y-%m-%dT%H:%M:%SZ"),
+        "to_date": to_date.strftime("%Y-%m-%dT%H:%M:%SZ"),
+        "group_by": group_by,
+    }
 
-    from_date = from_date.strftime("%Y-%m-%dT%H:%M:%SZ")
-    to_date = today.strftime("%Y-%m-%dT%H:%M:%SZ")
 
-    params = {"from_date": from_date, "to_date": to_date, "group_by": "1d"}
+def get_history(days: int):
+    today = datetime.datetime.now()
+    from_date = today - datetime.timedelta(days=days)
 
     try:
-        response = requests.get(base_url, params=params)
-        response.raise_for_status()
-
-        return response.json()
-    except requests.exceptions.HTTPError as e:
+        return fetch_range(from_date, today)
+    except Exception as e:
         logging.error(e)
         raise e
 
 
-def run(days=90):
-    # Set up logging
-    logging.basicConfig(level=logging.INFO)
-    logger = logging.getLogger(__name__)
+def _chunks(start, end, chunk_days):
+    step = datetime.timedelta(days=chunk_days)
+    chunk_start = start
+    while chunk_start < end:
+        chunk_end = min(chunk_start + step, end)
+        yield chunk_start, chunk_end
+        chunk_start = chunk_end
+
+
+def _is_checkpointed(session, job, chunk_start, chunk_end):
+    return (
+        session.query(BackfillCheckpoint.id)
+        .filter(
+            BackfillCheckpoint.job == job,
+            BackfillCheckpoint.chunk_start == chunk_start,
+            BackfillCheckpoint.chunk_end == chunk_end,
+        )
+        .first()
+        is not None
+    )
+
+
+def _is_present(session, chunk_start, chunk_end, group_size):
+    """True when every group_size period in the chunk is already stored."""
+    expected = (chunk_end - chunk_start) // group_size
+    duration = func.round(
+        (func.julianday(Period.end) - func.julianday(Period.start)) * 86400
+    )
+    stored = (
+        session.query(func.count(Period.id))
+        .filter(
+            Period.start >= chunk_start,
+            Period.end <= chunk_end,
+            duration == group_size.total_seconds(),
+        )
+        .scalar()
+    )
+    return stored >= expected
+
+
+def _load_chunk(session, job, chunk_start, chunk_end, batches, now):
+    """Load a chunk's batches, committing each, then checkpoint the chunk."""
+    counts = {"inserted": 0, "updated": 0, "skipped": 0}
+    rows = 0
+    for half_hourly_data in batches:
+        with metrics.stage("transform"):
+            period_rows, energy_rows = transform_rows(half_hourly_data)
+        with metrics.stage("load"):
+            for key, value in load_rows(session, period_rows, energy_rows).items():
+                counts[key] += value
+            session.commit()
+        rows += len(period_rows)
+
+    # The chunk holding today is still filling up; never checkpoint it so
+    # the next run fetches it again
+    if chunk_end <= now:
+        session.add(
+            BackfillCheckpoint(
+                job=job, chunk_start=chunk_start, chunk_end=chunk_end, rows=rows
+            )
+        )
+        session.commit()
+    logger.info("Loaded chunk %s - %s: %s", chunk_start, chunk_end, counts)
+    return counts
+
+
+def _pending_chunks(session, job, days, chunk_days, group_by):
+    """Return (now, chunks still to fetch) for the last `days` of history.
+
+    Chunks that are fully present but not yet checkpointed are checkpointed
+    here without being fetched.
+    """
+    group_size = GROUP_SIZES[group_by]
+
+    now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+    end = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    end += datetime.timedelta(days=1)
+    start = end - datetime.timedelta(days=days)
+    # Align the first chunk to the fixed grid so chunk bounds, and with them
+    # the checkpoints, stay the same from one day to the next
+    step = datetime.timedelta(days=chunk_days)
+    start = CHUNK_EPOCH + (start - CHUNK_EPOCH) // step * step
+
+    pending = []
+    for chunk_start, chunk_end in _chunks(start, end, chunk_days):
+        if _is_checkpointed(session, job, chunk_start, chunk_end):
+            continue
+        if chunk_end <= now and _is_present(
+            session, chunk_start, chunk_end, group_size
+        ):
+            session.add(
+                BackfillCheckpoint(
+                    job=job, chunk_start=chunk_start, chunk_end=chunk_end, rows=0
+                )
+            )
+            continue
+        pending.append((chunk_start, chunk_end))
+    session.commit()
+
+    logger.info("Backfill %s: %d chunks to fetch", job, len(pending))
+    return now, pending
+
+
+def backfill(
+    days=90,
+    chunk_days=7,
+    workers=4,
+    group_by="1d",
+    base_url=BASE_URL,
+    job=None,
+    stream=False,
+    batch_size=BATCH_SIZE,
+):
+    """Load the last `days` of history in `chunk_days` chunks.
+
+    Chunks are aligned to multiples of `chunk_days` since CHUNK_EPOCH, so the
+    first one may reach up to `chunk_days` - 1 days further back.
+
+    Chunks are fetched concurrently and each one is transformed, bulk loaded
+    and checkpointed in its own transaction, so an interrupted run resumes at
+    the first chunk that has not been committed. Chunks that are already
+    checkpointed or fully present in the database are not fetched again.
+
+    With `stream` the chunks are fetched one at a time and each response is
+    parsed and loaded in batches of `batch_size` as it downloads, bounding
+    memory by the batch size instead of the chunk size.
+    """
+    job = job or f"historic-energy-{group_by}"
 
     Base.metadata.create_all(engine)
     Session = sessionmaker(bind=engine)
 
-    data = get_history(days)
+    totals = {"inserted": 0, "updated": 0, "skipped": 0}
+
+    with Session() as session:
+        now, pending = _pending_chunks(session, job, days, chunk_days, group_by)
+
+        http = make_session(pool_size=workers)
+        if stream:
+            for chunk_start, chunk_end in pending:
+                batches = extract_batches(
+                    base_url,
+                    batch_size,
+                    _params(
+                        chunk_start, chunk_end - datetime.timedelta(seconds=1), group_by
+                    ),
+                    http,
+                )
+                counts = _load_chunk(session, job, chunk_start, chunk_end, batches, now)
+                for key in totals:
+                    totals[key] += counts[key]
+            return totals
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {
+                executor.submit(
+                    fetch_range,
+                    chunk_start,
+                    chunk_end - datetime.timedelta(seconds=1),
+                    group_by,
+                    base_url,
+                    http,
+                ): (chunk_start, chunk_end)
+                for chunk_start, chunk_end in pending
+            }
+            try:
+                for future in as_completed(futures):
+                    chunk_start, chunk_end = futures[future]
+                    half_hourly_data = future.result().get("halfHourlyData", [])
+                    counts = _load_chunk(
+                        session, job, chunk_start, chunk_end, [half_hourly_data], now
+                    )
+                    for key in totals:
+                        totals[key] += counts[key]
+            finally:
+                for future in futures:
+                    future.cancel()
+
+    return totals
+
 
-    half_hourly_data_historic_sample = data.get("halfHourlyData")
+def backfill_pipelined(
+    days=90,
+    chunk_days=7,
+    concurrency=4,
+    group_by="1d",
+    base_url=BASE_URL,
+    job=None,
+    **options,
+):
+    """Like backfill, but with fetching, transforming and loading overlapped.
+
+    Chunks go through run_pipeline; the single writer loads and checkpoints
+    whichever chunks are ready in one transaction each. `options` are passed
+    on to run_pipeline.
+    """
+    job = job or f"historic-energy-{group_by}"
+
+    Base.metadata.create_all(engine)
+    Session = sessionmaker(bind=engine)
 
-    # create db session
     with Session() as session:
-        for period in half_hourly_data_historic_sample:
-            period_instance = Period.from_dict(period)
-            generation_instance = Generation.from_dict(period, period_instance)
-            energy_type_instances = EnergyType.from_dict(
-                period["generationValues"], period_instance
-            )
-            session.add(period_instance)
-            session.add(generation_instance)
-            session.add_all(energy_type_instances)
+        now, pending = _pending_chunks(session, job, days, chunk_days, group_by)
 
-        session.commit()
+    async def extract(client, chunk):
+        chunk_start, chunk_end = chunk
+        params = _params(
+            chunk_start, chunk_end - datetime.timedelta(seconds=1), group_by
+        )
+        return (await client.get_json(base_url, params)).get("halfHourlyData", [])
+
+    def load(items):
+        counts = {"inserted": 0, "updated": 0, "skipped": 0}
+        with Session() as session:
+            for (chunk_start, chunk_end), (period_rows, energy_rows) in items:
+                for key, value in load_rows(session, period_rows, energy_rows).items():
+                    counts[key] += value
+                if chunk_end <= now:
+                    session.add(
+                        BackfillCheckpoint(
+                            job=job,
+                            chunk_start=chunk_start,
+                            chunk_end=chunk_end,
+                            rows=len(period_rows),
+                        )
+                    )
+            session.commit()
+        logger.info("Loaded %d chunks: %s", len(items), counts)
+        return counts
+
+    totals = {"inserted": 0, "updated": 0, "skipped": 0}
+    for counts in run_pipeline(
+        pending, extract, transform_rows, load, concurrency=concurrency, **options
+    ):
+        for key in totals:
+            totals[key] += counts[key]
+    return totals
+
+
+@metrics.timed
+def run(days=90, pipelined=False, **kwargs):
+    # Set up logging
+    logging.basicConfig(level=logging.INFO)
+
+    if pipelined:
+        totals = backfill_pipelined(days, **kwargs)
+    else:
+        totals = backfill(days, **kwargs)
+    logger.info("Historic energy backfill completed: %s", totals)
+    return totals
@@ -1,41 +1,78 @@
-import requests
-import json
-from sqlalchemy import create_engine
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from sqlalchemy.orm import sessionmaker
 
+from ...data import metrics
+from ...data.db import engine
 from ...data.models import Weather
+from ..http import make_session, RateLimiter
+from ..pipeline import run_pipeline
+from ..weather import load_weather_rows, weather_rows
 
 import datetime
 import os
 
+logger = logging.getLogger(__name__)
+
+BASE_URL = "http://api.weatherapi.com/v1/history.json"
 
-def fetch_weather(days):
-    api_key = os.environ.get("WEATHER_API_KEY")
 
+def _date_list(days):
     end_date = datetime.datetime.now()
     start_date = end_date - datetime.timedelta(days=days)
 
     # Create a list of dates between start_date and end_date
-    date_list = [
+    return [
         start_date + datetime.timedelta(days=x)
         for x in range(0, (end_date - start_date).days)
     ]
 
-    all_weather_data = []
 
-    # Iterate over each date and fetch the weather data
-    for date in date_list:
+def iter_weather(
+    days, workers=8, rate=5, location="London", base_url=BASE_URL, session=None
+):
+    """Fetch each day of history concurrently and yield (date, hours) pairs.
+
+    Days are yielded in completion order so the caller can load them as they
+    arrive. `rate` caps requests per second across all workers.
+    """
+    api_key = os.environ.get("WEATHER_API_KEY")
+    session = session or make_session(pool_size=workers)
+    limiter = RateLimiter(rate)
+
+    def fetch_day(date):
         formatted_date = date.strftime("%Y-%m-%d")
-        url = f"http://api.weatherapi.com/v1/history.json?key={api_key}&q=London&dt={formatted_date}"
-        response = requests.get(url)
-        if response.status_code == 200:
-            # Get the historical data for the day
-            daily_data = response.json()
-            all_weather_data.extend(daily_data["forecast"]["forecastday"][0]["hour"])
-        else:
-            print(
-                f"Failed to retrieve data for {formatted_date}: {response.status_code}"
+        limiter.wait()
+        response = session.get(
+            base_url, params={"key": api_key, "q": location, "dt": formatted_date}
+        )
+        if response.status_code != 200:
+            logger.warning(
+                "Failed to retrieve data for %s: %s",
+                formatted_date,
+                response.status_code,
             )
+            return formatted_date, []
+        # Get the historical data for the day
+        daily_data = response.json()
+        return formatted_date, daily_data["forecast"]["forecastday"][0]["hour"]
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(fetch_day, date) for date in _date_list(days)]
+        try:
+            for future in as_completed(futures):
+                yield future.result()
+        finally:
+            # Don't keep fetching if the consumer stopped early
+            for future in futures:
+                future.cancel()
+
+
+def fetch_weather(days, **kwargs):
+    all_weather_data = []
+    for _, hours in iter_weather(days, **kwargs):
+        all_weather_data.extend(hours)
 
     # Return all collected hourly data
     return all_weather_data
@@ -47,28 +84,74 @@ def transform_weather_data(hourly_forecasts):
 
 
 def load_weather_data(weathers, session):
-    for weather in weathers:
-        # Merge the 'weather' instance into the session. If a record with the same identifier already exists, it will be updated.
-        session.merge(weather)
+    # Observed hours, so these replace any forecast stored for the same time
+    load_weather_rows(session, weather_rows(weathers))
     session.commit()
 
 
-def run(days=90):
-    hourly_forecasts = fetch_weather(days)
-
-    if hourly_forecasts:
-        weathers = transform_weather_data(hourly_forecasts)
+def load_pipelined(days=90, concurrency=8, rate=5, location="London", **options):
+    """Load the last `days` of history through run_pipeline.
 
-        # Set up database connection
-        engine = create_engine("sqlite:///data.db")
-        Session = sessionmaker(bind=engine)
-        session = Session()
-
-        try:
-            load_weather_data(weathers, session)
-            print("Weather data loaded successfully.")
-        except Exception as e:
-            session.rollback()
-            print(f"An error occurred: {e}")
-        finally:
-            session.close()
+    Days are fetched `concurrency` at a time, transformed in the executor
+    and merged by the single writer, one transaction per batch of days.
+    Returns the number of hours loaded.
+    """
+    api_key = os.environ.get("WEATHER_API_KEY")
+    base_url = options.pop("base_url", BASE_URL)
+    limiter = RateLimiter(rate)
+    Session = sessionmaker(bind=engine)
+
+    async def extract(client, date):
+        await asyncio.to_thread(limiter.wait)
+        params = {"key": api_key, "q": location, "dt": date.strftime("%Y-%m-%d")}
+        daily_data = await client.get_json(base_url, params)
+        return daily_data["forecast"]["forecastday"][0]["hour"]
+
+    def load(items):
+        weathers = [weather for _, day in items for weather in day]
+        if weathers:
+            with Session() as session:
+                load_weather_data(weathers, session)
+        return len(weathers)
+
+    return sum(
+        run_pipeline(
+            _date_list(days),
+            extract,
+            transform_weather_data,
+            load,
+            concurrency=concurrency,
+            **options,
+        )
+    )
+
+
+@metrics.timed
+def run(days=90, pipelined=False, **kwargs):
+    if pipelined:
+        loaded_hours = load_pipelined(days, **kwargs)
+        print(f"Weather data loaded successfully for {loaded_hours} hours.")
+        return loaded_hours
+
+    Session = sessionmaker(bind=engine)
+    session = Session()
+
+    loaded_hours = 0
+    try:
+        loaded_days = 0
+        for date, hourly_forecasts in iter_weather(days, **kwargs):
+            if not hourly_forecasts:
+                continue
+            with metrics.stage("transform"):
+                weathers = transform_weather_data(hourly_forecasts)
+            with metrics.stage("load"):
+                load_weather_data(weathers, session)
+            loaded_days += 1
+            loaded_hours += len(weathers)
+        print(f"Weather data loaded successfully for {loaded_days} days.")
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+    return loaded_hours
@@ -0,0 +1,199 @@
+"""Asyncio ETL pipeline.
+
+Runs extract, transform and load as concurrent stages connected by bounded
+queues, so network, CPU and database time overlap:
+
+    sources -> extract (async, `concurrency` at once)
+            -> transform (executor, `transform_workers` at once)
+            -> load (one writer thread, batches of up to `write_batch`)
+
+Each queue holds at most `queue_size` items. A slow stage blocks the ones
+before it instead of letting payloads pile up, which bounds memory.
+
+The stages are plain functions: `extract(client, source)` is a coroutine
+that returns a payload, `transform(payload)` is a sync function, and
+`load(items)` is a sync function that receives a list of
+(source, transformed) pairs and owns its transaction. The first error in
+any stage cancels the whole pipeline and is raised from `run_pipeline`.
+"""
+
+import asyncio
+import functools
+import logging
+
+try:
+    import aiohttp
+except ImportError:  # pragma: no cover - falls back to requests in threads
+    aiohttp = None
+
+from ..data import metrics
+from .http import make_session
+
+logger = logging.getLogger(__name__)
+
+# Marks the end of a queue
+_DONE = object()
+
+
+class HttpClient:
+    """Async JSON client: aiohttp when installed, else requests in threads.
+
+    The requests fallback uses the retrying keep-alive session from
+    make_session, with `pool_size` connections.
+    """
+
+    def __init__(self, pool_size=10):
+        self.pool_size = pool_size
+        self.session = None
+
+    async def __aenter__(self):
+        if aiohttp is not None:
+            connector = aiohttp.TCPConnector(limit=self.pool_size)
+            self.session = aiohttp.ClientSession(connector=connector)
+        else:
+            self.session = make_session(pool_size=self.pool_size)
+        return self
+
+    async def __aexit__(self, *exc):
+        if aiohttp is not None:
+            await self.session.close()
+        else:
+            self.session.close()
+
+    async def get_json(self, url, params=None):
+        """GET `url` and return the parsed JSON, raising on an error status."""
+        if aiohttp is not None:
+            async with self.session.get(url, params=params) as response:
+                response.raise_for_status()
+                return await response.json(content_type=None)
+        return await asyncio.to_thread(self._get_json, url, params)
+
+    def _get_json(self, url, params):
+        response = self.session.get(url, params=params)
+        response.raise_for_status()
+        return response.json()
+
+
+async def _extract_stage(client, extract, sources, out):
+    while True:
+        source = await sources.get()
+        if source is _DONE:
+            return
+        with metrics.stage("extract"):
+            payload = await extract(client, source)
+        await out.put((source, payload))
+
+
+async def _transform_stage(transform, executor, inbox, out):
+    loop = asyncio.get_running_loop()
+    while True:
+        item = await inbox.get()
+        if item is _DONE:
+            return
+        source, payload = item
+        with metrics.stage("transform"):
+            transformed = await loop.run_in_executor(
+                executor, functools.partial(transform, payload)
+            )
+        await out.put((source, transformed))
+
+
+async def _load_stage(load, write_batch, inbox):
+    results = []
+    done = False
+    while not done:
+        item = await inbox.get()
+        if item is _DONE:
+            break
+        items = [item]
+        # Take whatever else is ready so each transaction covers more rows
+        while len(items) < write_batch and not inbox.empty():
+            item = inbox.get_nowait()
+            if item is _DONE:
+                done = True
+                break
+            items.append(item)
+        with metrics.stage("load"):
+            results.append(await asyncio.to_thread(load, items))
+    return results
+
+
+async def _run_stages(
+    sources,
+    extract,
+    transform,
+    load,
+    concurrency,
+    transform_workers,
+    queue_size,
+    write_batch,
+    executor,
+    pool_size,
+):
+    source_queue = asyncio.Queue()
+    for source in sources:
+        source_queue.put_nowait(source)
+    for _ in range(concurrency):
+        source_queue.put_nowait(_DONE)
+
+    raw = asyncio.Queue(maxsize=queue_size)
+    transformed = asyncio.Queue(maxsize=queue_size)
+
+    async with HttpClient(pool_size or concurrency) as client:
+        async with asyncio.TaskGroup() as group:
+            extractors = [
+                group.create_task(_extract_stage(client, extract, source_queue, raw))
+                for _ in range(concurrency)
+            ]
+            transformers = [
+                group.create_task(
+                    _transform_stage(transform, executor, raw, transformed)
+                )
+                for _ in range(transform_workers)
+            ]
+            writer = group.create_task(_load_stage(load, write_batch, transformed))
+
+            await asyncio.gather(*extractors)
+            for _ in transformers:
+                await raw.put(_DONE)
+            await asyncio.gather(*transformers)
+            await transformed.put(_DONE)
+    return writer.result()
+
+
+def run_pipeline(
+    sources,
+    extract,
+    transform,
+    load,
+    concurrency=4,
+    transform_workers=2,
+    queue_size=4,
+    write_batch=4,
+    executor=None,
+    pool_size=None,
+):
+    """Run the pipeline over `sources` and return the list of load results.
+
+    `executor` runs the transforms; the default is the event loop's thread
+    pool, and a ProcessPoolExecutor can be passed for transforms that hold
+    the GIL.
+    """
+    try:
+        return asyncio.run(
+            _run_stages(
+                list(sources),
+                extract,
+                transform,
+                load,
+                concurrency,
+                transform_workers,
+                queue_size,
+                write_batch,
+                executor,
+                pool_size,
+            )
+        )
+    except ExceptionGroup as group:
+        # Surface the first stage failure rather than the group
+        raise group.exceptions[0] from group
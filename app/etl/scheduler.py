@@ -0,0 +1,235 @@
+"""Long-running ETL scheduler.
+
+Runs each job on its own cadence in a thread pool:
+
+    python -m app.etl.scheduler              # energy, forecast weather, archive
+    python -m app.etl.scheduler --backfill   # also run both backfills once
+
+Recurring jobs fire on aligned boundaries (e.g. every settlement period) plus
+an offset and random jitter. If the scheduler falls behind, the missed runs
+are coalesced into a single catch-up run. A job never overlaps itself: a
+run that comes due while the previous one is still going is skipped.
+"""
+
+import argparse
+import logging
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+class Clock:
+    """Wall clock; tests can pass a fake with the same two methods."""
+
+    def now(self):
+        return time.time()
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+
+class Job:
+    """A named callable with a cadence and run metrics.
+
+    `interval` and `offset` are in seconds; runs are due at
+    k * interval + offset. Jobs with no interval only run when triggered.
+    The callable may return a row count or a dict of counts.
+    """
+
+    def __init__(
+        self, name, func, interval=None, offset=0, jitter=0, run_on_start=False
+    ):
+        self.name = name
+        self.func = func
+        self.interval = interval
+        self.offset = offset
+        self.jitter = jitter
+        self.run_on_start = run_on_start
+        self.lock = threading.Lock()
+
+        self.runs = 0
+        self.failures = 0
+        self.skipped = 0
+        self.missed = 0
+        self.rows = 0
+        self.last_duration = None
+        self.total_duration = 0.0
+        self.last_error = None
+
+    def next_after(self, when):
+        """First boundary strictly after `when`."""
+        periods = (when - self.offset) // self.interval + 1
+        return periods * self.interval + self.offset
+
+    def metrics(self):
+        return {
+            "runs": self.runs,
+            "failures": self.failures,
+            "skipped": self.skipped,
+            "missed": self.missed,
+            "rows": self.rows,
+            "last_duration": self.last_duration,
+            "mean_duration": self.total_duration / self.runs if self.runs else None,
+            "last_error": self.last_error,
+        }
+
+
+def _row_count(result):
+    if isinstance(result, dict):
+        return result.get("inserted", 0) + result.get("updated", 0)
+    return result or 0
+
+
+class Scheduler:
+    def __init__(self, jobs, clock=None, workers=4, seed=None):
+        self.jobs = {job.name: job for job in jobs}
+        self.clock = clock or Clock()
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.random = random.Random(seed)
+        self.due = {}
+        self._stop = threading.Event()
+
+        now = self.clock.now()
+        for job in self.jobs.values():
+            if job.interval is None:
+                continue
+            self.due[job.name] = now if job.run_on_start else self._schedule(job, now)
+
+    def _schedule(self, job, now):
+        return job.next_after(now) + self.random.uniform(0, job.jitter)
+
+    def trigger(self, name):
+        """Run a job now, e.g. a backfill on demand. Returns its future."""
+        return self._submit(self.jobs[name])
+
+    def _submit(self, job):
+        if not job.lock.acquire(blocking=False):
+            job.skipped += 1
+            logger.warning("%s is still running; skipping this run", job.name)
+            return None
+        try:
+            return self.executor.submit(self._run, job)
+        except BaseException:
+            # e.g. RuntimeError once stop() has shut the executor down
+            job.lock.release()
+            raise
+
+    def _run(self, job):
+        started = self.clock.now()
+        try:
+            result = job.func()
+            job.rows += _row_count(result)
+            job.last_error = None
+            return result
+        except Exception as e:
+            job.failures += 1
+            job.last_error = repr(e)
+            logger.exception("%s failed", job.name)
+        finally:
+            job.last_duration = self.clock.now() - started
+            job.total_duration += job.last_duration
+            job.runs += 1
+            job.lock.release()
+            logger.info(
+                "%s finished in %.1fs (%s rows in total)",
+                job.name,
+                job.last_duration,
+                job.rows,
+            )
+
+    def run_pending(self):
+        """Submit every job that is due. Returns the futures submitted."""
+        now = self.clock.now()
+        futures = []
+        for name, due in self.due.items():
+            if due > now:
+                continue
+            job = self.jobs[name]
+            missed = int((now - due) // job.interval)
+            if missed:
+                job.missed += missed
+                logger.warning("%s missed %d runs; catching up once", name, missed)
+            futures.append(self._submit(job))
+            self.due[name] = self._schedule(job, now)
+        return [future for future in futures if future is not None]
+
+    def run_forever(self, poll=1.0):
+        while not self._stop.is_set():
+            self.run_pending()
+            wait = min(self.due.values(), default=self.clock.now() + poll)
+            self.clock.sleep(min(max(wait - self.clock.now(), 0), poll))
+
+    def stop(self, wait=True):
+        self._stop.set()
+        self.executor.shutdown(wait=wait)
+
+    def metrics(self):
+        return {name: job.metrics() for name, job in self.jobs.items()}
+
+
+def default_jobs():
+    from ..data import archive
+    from . import energy, weather
+    from .historic import energy as historic_energy
+    from .historic import weather as historic_weather
+
+    jobs = [
+        # New settlement period data is published shortly after each half hour
+        Job(
+            "energy",
+            energy.run,
+            interval=30 * 60,
+            offset=5 * 60,
+            jitter=60,
+            run_on_start=True,
+        ),
+        Job(
+            "weather",
+            weather.run,
+            interval=60 * 60,
+            offset=2 * 60,
+            jitter=60,
+            run_on_start=True,
+        ),
+        Job("historic-energy", historic_energy.run),
+        Job("historic-weather", historic_weather.run),
+    ]
+    # The Parquet archive needs the optional pyarrow
+    if archive.pa is not None:
+        # Compact closed months, and rewrite stale ones, once a night
+        jobs.append(
+            Job("archive", archive.compact, interval=24 * 60 * 60, offset=3 * 60 * 60)
+        )
+    return jobs
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--backfill", action="store_true", help="run both backfills once at start"
+    )
+    parser.add_argument("--workers", type=int, default=4)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+
+    from ..data.migrations import migrate
+
+    migrate()
+
+    scheduler = Scheduler(default_jobs(), workers=args.workers)
+    if args.backfill:
+        scheduler.trigger("historic-weather")
+        scheduler.trigger("historic-energy")
+    try:
+        scheduler.run_forever()
+    except KeyboardInterrupt:
+        logger.info("Stopping; job metrics: %s", scheduler.metrics())
+        scheduler.stop(wait=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""Incremental parsing of large JSON API responses."""
+
+import codecs
+import itertools
+import json
+
+WHITESPACE = " \t\r\n"
+
+
+def iter_array(chunks, key, encoding="utf-8"):
+    """Yield the elements of the array under `key` as they are parsed.
+
+    `chunks` is an iterable of bytes, such as response.iter_content(). Only
+    the element being parsed and the unread part of the current chunk are
+    held in memory, however long the array is. The key is matched wherever
+    it first appears, which suits the API's flat top-level objects.
+    """
+    decoder = json.JSONDecoder()
+    text = codecs.getincrementaldecoder(encoding)()
+    chunks = iter(chunks)
+    buffer = ""
+    pos = 0
+
+    def read():
+        nonlocal buffer, pos
+        for chunk in chunks:
+            data = text.decode(chunk)
+            if data:
+                buffer = buffer[pos:] + data
+                pos = 0
+                return True
+        return False
+
+    def skip_whitespace():
+        nonlocal pos
+        while True:
+            while pos < len(buffer) and buffer[pos] in WHITESPACE:
+                pos += 1
+            if pos < len(buffer) or not read():
+                return
+
+    def expect(char):
+        nonlocal pos
+        skip_whitespace()
+        if buffer[pos : pos + 1] != char:
+            raise ValueError(f"Expected {char!r} after {key!r} in JSON stream")
+        pos += 1
+
+    # Find the key; keep enough of the buffer to match a key split over chunks
+    marker = json.dumps(key)
+    while True:
+        index = buffer.find(marker, pos)
+        if index >= 0:
+            pos = index + len(marker)
+            break
+        pos = max(pos, len(buffer) - len(marker))
+        if not read():
+            raise ValueError(f"{key!r} not found in JSON stream")
+    expect(":")
+    expect("[")
+
+    while True:
+        skip_whitespace()
+        if pos >= len(buffer):
+            raise ValueError(f"JSON stream ended inside {key!r}")
+        if buffer[pos] == "]":
+            return
+        if buffer[pos] == ",":
+            pos += 1
+            continue
+        try:
+            value, pos = decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError:
+            # element continues in the next chunk
+            if not read():
+                raise
+            continue
+        yield value
+
+
+def batched(iterable, size):
+    """Yield lists of up to `size` items."""
+    iterator = iter(iterable)
+    while batch := list(itertools.islice(iterator, size)):
+        yield batch
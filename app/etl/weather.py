@@ -1,31 +1,43 @@
+import datetime
 import requests
 import os
+from sqlalchemy import or_
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.orm import sessionmaker
 
 # Import your Weather model here
-from app.data.db import engine
-from ..data.models import Weather
+from ..data import metrics
+from ..data.db import engine
+from ..data.models import Weather, WeatherForecast
+from ..data.version import bump_data_version
+from .cache import HttpCache
+from .derived import refresh_correlation_stats, weather_days
 
 Session = sessionmaker(bind=engine)
 
+FORECAST_URL = "http://api.weatherapi.com/v1/forecast.json"
+
+WEATHER_COLUMNS = [c.key for c in Weather.__table__.columns if c.key != "id"]
+FORECAST_COLUMNS = [
+    c.key
+    for c in WeatherForecast.__table__.columns
+    if c.key not in ("id", "fetched_at")
+]
 
-def fetch_tomorrows_weather(api_key, location="London"):
-    # Define the endpoint for the forecast
-    url = (
-        f"http://api.weatherapi.com/v1/forecast.json?key={api_key}&q={location}&days=1"
-    )
 
-    # Make a GET request to fetch the weather data
-    response = requests.get(url)
-    if response.status_code == 200:
-        # Parse the JSON response
-        weather_data = response.json()
-        # Extract tomorrow's forecast
-        tomorrow_forecast = weather_data["forecast"]["forecastday"][0]
-        return tomorrow_forecast
-    else:
-        print(f"Failed to retrieve data: {response.status_code}")
-        return None
+def fetch_tomorrows_weather(
+    api_key, location="London", base_url=FORECAST_URL, cache=None
+):
+    """Return (response, tomorrow's forecast), or (None, None) on failure."""
+    cache = cache or HttpCache()
+    try:
+        response = cache.get(base_url, {"key": api_key, "q": location, "days": 1})
+    except requests.HTTPError as e:
+        print(f"Failed to retrieve data: {e.response.status_code}")
+        return None, None
+    # Extract tomorrow's forecast
+    tomorrow_forecast = response.json()["forecast"]["forecastday"][0]
+    return response, tomorrow_forecast
 
 
 def transform_weather_data(daily_forecast):
@@ -36,32 +48,101 @@ def transform_weather_data(daily_forecast):
     # return Weather.from_dict(daily_forecast)
 
 
-def load_weather_data(weather):
+def weather_rows(weather):
+    """Weather objects as rows for load_weather_rows."""
+    return [
+        {column: getattr(entry, column) for column in WEATHER_COLUMNS}
+        for entry in weather
+    ]
+
+
+def _upsert_statement():
+    statement = sqlite_insert(Weather.__table__)
+    excluded = statement.excluded
+    return statement.on_conflict_do_update(
+        index_elements=["time"],
+        set_={
+            column: excluded[column] for column in WEATHER_COLUMNS if column != "time"
+        },
+        # Observed hours replace anything; forecasts only replace forecasts
+        where=or_(excluded.prediction == 0, Weather.__table__.c.prediction == 1),
+    )
+
+
+def load_weather_rows(session, rows, keep_vintages=False):
+    """Upsert weather rows (dicts of Weather columns) keyed on time.
+
+    The batch is written with a single executemany of INSERT ... ON CONFLICT,
+    so it costs no per-row lookups and can be re-run safely. Rows with
+    prediction=1 are forecasts and never overwrite an observed hour. With
+    `keep_vintages` forecast rows are also appended to weather_forecasts,
+    stamped with the time they were loaded. The caller owns the transaction.
+    Returns the number of rows written.
+    """
+    rows = [{column: row.get(column) for column in WEATHER_COLUMNS} for row in rows]
+    for row in rows:
+        row["prediction"] = row["prediction"] or 0
+    if not rows:
+        return 0
+
+    written = session.execute(_upsert_statement(), rows).rowcount
+
+    if keep_vintages:
+        fetched_at = datetime.datetime.utcnow()
+        vintages = [
+            {
+                "fetched_at": fetched_at,
+                **{column: row[column] for column in FORECAST_COLUMNS},
+            }
+            for row in rows
+            if row["prediction"]
+        ]
+        if vintages:
+            session.execute(
+                sqlite_insert(WeatherForecast.__table__).on_conflict_do_nothing(),
+                vintages,
+            )
+
+    if written:
+        refresh_correlation_stats(session, weather_days(row["time"] for row in rows))
+        bump_data_version(session, {"weather": min(row["time"] for row in rows)})
+    return written
+
+
+def load_weather_data(weather, keep_vintages=False):
     with Session() as session:
-        for entry in weather:
-            session.add(entry)
+        load_weather_rows(session, weather_rows(weather), keep_vintages)
         session.commit()
 
 
-def run():
+@metrics.timed
+def run(base_url=FORECAST_URL, cache=None, keep_vintages=False):
     api_key = api_key = os.environ.get("WEATHER_API_KEY")
+    cache = cache or HttpCache()
 
     # Fetch tomorrow's weather forecast
-    forecast = fetch_tomorrows_weather(api_key)
+    with metrics.stage("extract"):
+        response, forecast = fetch_tomorrows_weather(
+            api_key, base_url=base_url, cache=cache
+        )
     if forecast:
-        # write to local json file
-        import json
-
-        with open("weather.json", "w") as f:
-            json.dump(forecast, f)
-
-        weather = transform_weather_data(forecast["hour"])
-
-        try:
-            load_weather_data(weather)
-            print("Weather data loaded successfully.")
-        except:
-            print("Weather data failed to load.")
+        # The response also carries the current conditions, which change on
+        # every poll, so only compare the forecast itself
+        if cache.seen(response, forecast):
+            print("Weather forecast unchanged; skipping.")
+            return 0
+
+        # transform_weather_data tags the hours in place; keep the forecast
+        # as fetched for mark_seen
+        with metrics.stage("transform"):
+            weather = transform_weather_data([dict(hour) for hour in forecast["hour"]])
+
+        with metrics.stage("load"):
+            load_weather_data(weather, keep_vintages)
+        cache.mark_seen(response, forecast)
+        print("Weather data loaded successfully.")
+        return len(weather)
+    return 0
 
 
 if __name__ == "__main__":
@@ -1,98 +1,387 @@
+import datetime
+import itertools
 import sqlite3
+import threading
+
+import numpy as np
 import pandas as pd
 
+try:
+    from ..data import archive
+    from ..data.db import DATABASE_PATH, make_engine, read_engine
+except ImportError:  # imported as the top-level `reports` package by app.py
+    from data import archive
+    from data.db import DATABASE_PATH, make_engine, read_engine
+
+WEATHER_VARIABLES = ["temp_c", "wind_mph", "humidity", "precip_mm", "cloud", "uv"]
+ENERGY_TYPES = [
+    "Biomass",
+    "Coal",
+    "Gas",
+    "Hydro",
+    "Imports",
+    "Misc",
+    "Nuclear",
+    "PSH",
+    "Solar",
+    "Wind",
+]
+
+# Rows accumulated per numpy update; bounds memory regardless of history size
+CHUNK_SIZE = 5000
+
+# (database_path, data_version) -> correlations, see get_corr
+_cache = {}
+_cache_lock = threading.Lock()
+
+# Read-only engines by database path, so every connection gets the pragmas
+_engines = {DATABASE_PATH: read_engine}
+_engines_lock = threading.Lock()
+
+
+class Moments:
+    """Pairwise sufficient statistics for Pearson correlation.
+
+    Holds counts, sums, sums of squares and cross-products for every
+    (x column, y column) pair. Missing values (NaN) are excluded pairwise, as
+    DataFrame.corr does.
+    """
+
+    def __init__(self, x_size, y_size):
+        shape = (x_size, y_size)
+        self.n = np.zeros(shape)
+        self.sum_x = np.zeros(shape)
+        self.sum_y = np.zeros(shape)
+        self.sum_xx = np.zeros(shape)
+        self.sum_yy = np.zeros(shape)
+        self.sum_xy = np.zeros(shape)
+
+    def update(self, x, y):
+        """Add rows from x (rows, x_size) and y (rows, y_size)."""
+        has_x = ~np.isnan(x)
+        has_y = ~np.isnan(y)
+        x = np.where(has_x, x, 0.0)
+        y = np.where(has_y, y, 0.0)
+        has_x = has_x.astype(float)
+        has_y = has_y.astype(float)
+
+        self.n += has_x.T @ has_y
+        self.sum_x += x.T @ has_y
+        self.sum_y += has_x.T @ y
+        self.sum_xx += (x * x).T @ has_y
+        self.sum_yy += has_x.T @ (y * y)
+        self.sum_xy += x.T @ y
+
+    def corr(self):
+        n = self.n
+        cov = n * self.sum_xy - self.sum_x * self.sum_y
+        var_x = n * self.sum_xx - self.sum_x**2
+        var_y = n * self.sum_yy - self.sum_y**2
+        with np.errstate(divide="ignore", invalid="ignore"):
+            corr = cov / np.sqrt(var_x * var_y)
+        corr[n < 2] = np.nan
+        return corr
+
+    def to_rows(self, day):
+        """Rows for the correlation_stats table, one per variable pair."""
+        for i, variable in enumerate(WEATHER_VARIABLES):
+            for j, energy_type in enumerate(ENERGY_TYPES):
+                yield (
+                    day,
+                    variable,
+                    energy_type,
+                    self.n[i, j],
+                    self.sum_x[i, j],
+                    self.sum_y[i, j],
+                    self.sum_xx[i, j],
+                    self.sum_yy[i, j],
+                    self.sum_xy[i, j],
+                )
+
+    @classmethod
+    def from_rows(cls, rows):
+        """Build from (variable, energy_type, n, sums...) rows."""
+        moments = cls(len(WEATHER_VARIABLES), len(ENERGY_TYPES))
+        for variable, energy_type, *stats in rows:
+            i = WEATHER_VARIABLES.index(variable)
+            j = ENERGY_TYPES.index(energy_type)
+            (
+                moments.n[i, j],
+                moments.sum_x[i, j],
+                moments.sum_y[i, j],
+                moments.sum_xx[i, j],
+                moments.sum_yy[i, j],
+                moments.sum_xy[i, j],
+            ) = stats
+        return moments
+
+
+def _engine(database_path):
+    with _engines_lock:
+        engine = _engines.get(database_path)
+        if engine is None:
+            engine = _engines[database_path] = make_engine(database_path, readonly=True)
+    return engine
+
+
+def _connect(database_path):
+    """A pooled DBAPI connection to `database_path`; close() returns it."""
+    return _engine(database_path).raw_connection()
+
+
+def get_data_version(database_path):
+    """Read the marker the ETL bumps on every load (0 if never loaded)."""
+    conn = _connect(database_path)
+    try:
+        row = conn.execute("SELECT version FROM data_version WHERE id = 1").fetchone()
+    except sqlite3.OperationalError:
+        row = None
+    finally:
+        conn.close()
+    return row[0] if row else 0
+
+
+def get_corr(database_path=DATABASE_PATH, start=None, end=None):
+    """Correlations between weather variables and energy types.
+
+    Read from the daily statistics the ETL maintains, optionally limited to
+    the days in [start, end). Cached until the ETL bumps the data version.
+    """
+    with _cache_lock:
+        version = get_data_version(database_path)
+        key = (database_path, version, start, end)
+        if key not in _cache:
+            for stale in [k for k in _cache if k[:2] != key[:2]]:
+                del _cache[stale]
+            _cache[key] = read_corr(database_path, start, end)
+        return _cache[key]
+
+
+def read_corr(database_path=DATABASE_PATH, start=None, end=None):
+    """Merge the stored daily statistics for [start, end) into correlations."""
+    query = """
+        SELECT weather_variable, energy_type,
+            SUM(n), SUM(sum_x), SUM(sum_y), SUM(sum_xx), SUM(sum_yy), SUM(sum_xy)
+        FROM correlation_stats
+        WHERE day >= ? AND day < ?
+        GROUP BY weather_variable, energy_type
+    """
+    start = start.isoformat() if start else "0000-01-01"
+    end = end.isoformat() if end else "9999-12-31"
+
+    conn = _connect(database_path)
+    try:
+        moments = Moments.from_rows(conn.execute(query, (start, end)))
+    finally:
+        conn.close()
+
+    return pd.DataFrame(moments.corr(), index=WEATHER_VARIABLES, columns=ENERGY_TYPES)
+
+
+def _stream(cursor):
+    while True:
+        rows = cursor.fetchmany(CHUNK_SIZE)
+        if not rows:
+            return
+        yield from rows
 
-# Function to load a full table into a DataFrame
-def load_full_table(database_path, table_name):
-    conn = sqlite3.connect(database_path)
-    query = f"SELECT * FROM {table_name};"
-    df = pd.read_sql_query(query, conn)
-    conn.close()
-    return df
 
+def _energy_rows(conn, start="0000-01-01", end="9999-12-31"):
+    """Periods with one column per energy type, read from period_generation.
 
-def get_corr():
-    # Load the weather dataset from data.db
-    df_weather = load_full_table("data.db", "weather")
+    Rows are (epoch seconds, day, *totals) for periods starting in [start, end).
+    """
+    # period_generation names its fuel columns after the lower-cased types
+    columns = ", ".join(energy_type.lower() for energy_type in ENERGY_TYPES)
+    query = f"""
+        SELECT CAST(strftime('%s', start) AS INTEGER), date(start), {columns}
+        FROM period_generation
+        WHERE start >= ? AND start < ?
+        ORDER BY start
+    """
+    return _stream(conn.execute(query, (start, end)))
 
-    # Load the energy data from data_h.db
-    df_periods = load_full_table("data.db", "periods")
-    df_energy_types = load_full_table("data.db", "energy_types")
 
-    # Convert timestamps to datetime for both energy and weather data
-    df_periods["start"] = pd.to_datetime(df_periods["start"])
-    df_weather["time"] = pd.to_datetime(df_weather["time"])
+def _weather_rows(conn, start="0000-01-01", end="9999-12-31"):
+    """Weather rows as (epoch seconds, *variables) for times in [start, end)."""
+    columns = ", ".join(WEATHER_VARIABLES)
+    query = f"""
+        SELECT CAST(strftime('%s', time) AS INTEGER), {columns}
+        FROM weather
+        WHERE time >= ? AND time < ?
+        ORDER BY time
+    """
+    return _stream(conn.execute(query, (start, end)))
 
-    # Merge the periods and energy_types tables on the period_id
-    df_energy = pd.merge(
-        df_periods, df_energy_types, left_on="id", right_on="period_id"
+
+def _nearest(energy_rows, weather_rows):
+    """Pair each period with the weather row closest to its start.
+
+    Both inputs are sorted by time, so this is a streaming equivalent of
+    merge_asof(direction="nearest"). Yields (weather row, energy row).
+    """
+    weather_rows = iter(weather_rows)
+    previous = None
+    following = next(weather_rows, None)
+    for energy in energy_rows:
+        start = energy[0]
+        while following is not None and following[0] <= start:
+            previous, following = following, next(weather_rows, None)
+        if previous is None and following is None:
+            return
+        if following is None or (
+            previous is not None and start - previous[0] <= following[0] - start
+        ):
+            yield previous, energy
+        else:
+            yield following, energy
+
+
+def accumulate(moments, pairs):
+    """Feed (weather, energy) row pairs into moments, CHUNK_SIZE at a time."""
+    pairs = iter(pairs)
+    while True:
+        chunk = list(itertools.islice(pairs, CHUNK_SIZE))
+        if not chunk:
+            return moments
+        weather, energy = zip(*chunk)
+        moments.update(np.array(weather, dtype=float), np.array(energy, dtype=float))
+
+
+def refresh_stats(conn, days):
+    """Recompute the stored daily statistics covering `days`.
+
+    Every day from the earliest to the latest of `days` is rebuilt from the
+    periods and weather on `conn`, inside the caller's transaction. Weather
+    from the neighbouring days is included so periods near midnight still
+    pair with their nearest hour.
+    """
+    if not days:
+        return
+    first = min(days)
+    last = max(days) + datetime.timedelta(days=1)
+    conn.execute(
+        "DELETE FROM correlation_stats WHERE day >= ? AND day < ?",
+        (first.isoformat(), last.isoformat()),
     )
 
-    # Merge the energy data with the weather data on the closest timestamps
-    df_combined = pd.merge_asof(
-        df_energy.sort_values("start"),
-        df_weather.sort_values("time"),
-        left_on="start",
-        right_on="time",
-        direction="nearest",
+    pairs = _nearest(
+        _energy_rows(conn, first.isoformat(), last.isoformat()),
+        _weather_rows(
+            conn,
+            (first - datetime.timedelta(days=1)).isoformat(),
+            (last + datetime.timedelta(days=1)).isoformat(),
+        ),
     )
+    rows = []
+    for day, day_pairs in itertools.groupby(pairs, key=lambda pair: pair[1][1]):
+        moments = accumulate(
+            Moments(len(WEATHER_VARIABLES), len(ENERGY_TYPES)),
+            ((weather[1:], energy[2:]) for weather, energy in day_pairs),
+        )
+        rows.extend(moments.to_rows(day))
+
+    conn.executemany(
+        "INSERT INTO correlation_stats (day, weather_variable, energy_type, n, "
+        "sum_x, sum_y, sum_xx, sum_yy, sum_xy) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        rows,
+    )
+
+
+def rebuild_stats(conn):
+    """Recompute the daily statistics for every stored period."""
+    first, last = conn.execute(
+        "SELECT MIN(date(start)), MAX(date(start)) FROM periods"
+    ).fetchone()
+    if first is not None:
+        refresh_stats(
+            conn,
+            [datetime.date.fromisoformat(first), datetime.date.fromisoformat(last)],
+        )
+
+
+def _epochs(column):
+    return column.to_numpy().astype("datetime64[s]").astype(np.int64)
+
+
+def _floats(column):
+    return column.cast(archive.pa.float64()).to_numpy(zero_copy_only=False)
+
+
+def _archived_moments(connection):
+    """Moments over the whole history, read through the Parquet archive.
+
+    Only the needed columns are read. Each period is paired with the weather
+    hour nearest its start, as _nearest does, with a vectorised search.
+    """
+    moments = Moments(len(WEATHER_VARIABLES), len(ENERGY_TYPES))
+    energy = archive.read_table(
+        connection,
+        "period_generation",
+        ["start", *(energy_type.lower() for energy_type in ENERGY_TYPES)],
+    )
+    weather = archive.read_table(connection, "weather", ["time", *WEATHER_VARIABLES])
+    starts = _epochs(energy.column("start"))
+    times = _epochs(weather.column("time"))
+    if not len(times):
+        return moments
+
+    # Ties go to the earlier hour, as in _nearest
+    following = np.searchsorted(times, starts, side="right")
+    previous = following - 1
+    use_previous = (following == len(times)) | (
+        (previous >= 0)
+        & (
+            starts - times[np.maximum(previous, 0)]
+            <= times[np.minimum(following, len(times) - 1)] - starts
+        )
+    )
+    nearest = np.where(use_previous, previous, following)
+
+    x = np.column_stack(
+        [_floats(weather.column(v))[nearest] for v in WEATHER_VARIABLES]
+    )
+    y = np.column_stack(
+        [_floats(energy.column(energy_type.lower())) for energy_type in ENERGY_TYPES]
+    )
+    for i in range(0, len(starts), CHUNK_SIZE):
+        moments.update(x[i : i + CHUNK_SIZE], y[i : i + CHUNK_SIZE])
+    return moments
+
+
+def _has_archive(database_path):
+    if archive.pa is None:
+        return False
+    with _engine(database_path).connect() as connection:
+        return any(
+            archive.archived_months(connection, dataset)
+            for dataset in ("period_generation", "weather")
+        )
+
+
+def compute_corr(database_path=DATABASE_PATH):
+    """Correlations over the whole history.
+
+    Read through the Parquet archive once months have been archived,
+    otherwise streamed straight from the tables.
+    """
+    if _has_archive(database_path):
+        with _engine(database_path).connect() as connection:
+            moments = _archived_moments(connection)
+    else:
+        conn = _connect(database_path)
+        try:
+            moments = accumulate(
+                Moments(len(WEATHER_VARIABLES), len(ENERGY_TYPES)),
+                (
+                    (weather[1:], energy[2:])
+                    for weather, energy in _nearest(
+                        _energy_rows(conn), _weather_rows(conn)
+                    )
+                ),
+            )
+        finally:
+            conn.close()
 
-    # Pivot the 'type_name' and 'total' to create separate columns for each energy type
-    df_pivot_energy = df_combined.pivot_table(
-        index=[
-            "start",
-            "end",
-            "time",
-            "temp_c",
-            "wind_mph",
-            "humidity",
-            "precip_mm",
-            "cloud",
-            "uv",
-        ],
-        columns="type_name",
-        values="total",
-    ).reset_index()
-
-    # Calculate the correlation matrix for selected weather variables and energy types
-    selected_columns = [
-        "temp_c",
-        "wind_mph",
-        "humidity",
-        "precip_mm",
-        "cloud",
-        "uv",
-        "Biomass",
-        "Coal",
-        "Gas",
-        "Hydro",
-        "Imports",
-        "Misc",
-        "Nuclear",
-        "PSH",
-        "Solar",
-        "Wind",
-    ]
-    correlation_matrix = df_pivot_energy[selected_columns].corr()
-
-    # Display the correlations for weather variables with the energy types
-    correlations = correlation_matrix.loc[
-        ["temp_c", "wind_mph", "humidity", "precip_mm", "cloud", "uv"],
-        [
-            "Biomass",
-            "Coal",
-            "Gas",
-            "Hydro",
-            "Imports",
-            "Misc",
-            "Nuclear",
-            "PSH",
-            "Solar",
-            "Wind",
-        ],
-    ]
-
-    return correlations
-
-
-print(get_corr())
+    # Correlations of each weather variable with each energy type
+    return pd.DataFrame(moments.corr(), index=WEATHER_VARIABLES, columns=ENERGY_TYPES)
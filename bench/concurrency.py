@@ -0,0 +1,127 @@
+"""Dashboard reader latency while the ETL writes.
+
+N reader threads run the dashboard's DAL queries while one writer bulk loads
+new periods, first on a plain engine (rollback journal, default pragmas) and
+then on the tuned engines from app.data.db.
+
+python -m bench.concurrency --readers 8 --seconds 10
+"""
+
+import argparse
+import datetime
+import os
+import shutil
+import statistics
+import tempfile
+import threading
+import time
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session
+
+from app.data.dal import DataAccessLayer
+from app.data.db import make_engine
+from app.data.migrations import migrate
+from app.etl.energy import _to_rows, load_rows, transform
+from .synthetic import START, generate_database, iter_periods
+
+QUERIES = [
+    lambda dal: dal.get_carbon_intensity_over_time(points=1000),
+    lambda dal: dal.get_energy_mix(),
+    lambda dal: dal.get_weather(points=1000),
+    lambda dal: dal.get_wind_data(START.date() + datetime.timedelta(days=100)),
+]
+
+
+def _reader(engine, stop, latencies, errors):
+    i = 0
+    while not stop.is_set():
+        query = QUERIES[i % len(QUERIES)]
+        i += 1
+        started = time.perf_counter()
+        try:
+            with Session(engine) as session:
+                query(DataAccessLayer(session))
+        except Exception:
+            errors.append(1)
+            continue
+        latencies.append(time.perf_counter() - started)
+
+
+def _writer(engine, stop, years, commits):
+    # Half-hourly periods continuing after the generated history, a day per commit
+    start = START + datetime.timedelta(days=int(years * 365))
+    entries = iter_periods(years=10, start=start, seed=1)
+    while not stop.is_set():
+        batch = [next(entries) for _ in range(48)]
+        with Session(engine) as session:
+            load_rows(session, *_to_rows(transform(batch)))
+            session.commit()
+        commits.append(1)
+
+
+def _run(read_engine, write_engine, readers, seconds, years):
+    stop = threading.Event()
+    latencies, errors, commits = [], [], []
+    threads = [
+        threading.Thread(target=_reader, args=(read_engine, stop, latencies, errors))
+        for _ in range(readers)
+    ]
+    threads.append(
+        threading.Thread(target=_writer, args=(write_engine, stop, years, commits))
+    )
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    latencies.sort()
+    p99 = latencies[int(len(latencies) * 0.99) - 1] if latencies else float("nan")
+    return {
+        "reads": len(latencies),
+        "p50_ms": statistics.median(latencies) * 1000 if latencies else float("nan"),
+        "p99_ms": p99 * 1000,
+        "read_errors": len(errors),
+        "commits": len(commits),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--readers", type=int, default=8)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--years", type=float, default=1)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    try:
+        plain_path = os.path.join(workdir, "plain.db")
+        tuned_path = os.path.join(workdir, "tuned.db")
+        migrate(generate_database(plain_path, args.years))
+        shutil.copy(plain_path, tuned_path)
+
+        plain = create_engine(f"sqlite:///{plain_path}")
+        results = {
+            "plain": _run(plain, plain, args.readers, args.seconds, args.years),
+            "tuned": _run(
+                make_engine(tuned_path, readonly=True),
+                make_engine(tuned_path),
+                args.readers,
+                args.seconds,
+                args.years,
+            ),
+        }
+        for name, result in results.items():
+            print(
+                f"{name:>6}: {result['reads']} reads, "
+                f"p50 {result['p50_ms']:.1f} ms, p99 {result['p99_ms']:.1f} ms, "
+                f"{result['read_errors']} read errors, {result['commits']} commits"
+            )
+    finally:
+        shutil.rmtree(workdir)
+
+
+if __name__ == "__main__":
+    main()
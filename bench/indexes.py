@@ -0,0 +1,110 @@
+"""Compare query plans and latency with and without the schema indexes.
+
+python -m bench.indexes --years 3
+"""
+
+import argparse
+import datetime
+import os
+import shutil
+import statistics
+import tempfile
+import time
+
+from sqlalchemy import create_engine
+
+from app.data.db import Base
+from app.data.migrations import migrate
+from .synthetic import START, TIME_FORMAT, generate_database
+
+DAY = (START + datetime.timedelta(days=200)).strftime(TIME_FORMAT)
+NEXT_DAY = (START + datetime.timedelta(days=201)).strftime(TIME_FORMAT)
+
+QUERIES = {
+    "period lookup (etl dedupe)": (
+        'SELECT id FROM periods WHERE start = ? AND "end" = ?',
+        (DAY, (START + datetime.timedelta(days=200, minutes=30)).strftime(TIME_FORMAT)),
+    ),
+    "period range (bulk loader)": (
+        'SELECT id, start, "end", carbon_intensity, settlement_period '
+        "FROM periods WHERE start BETWEEN ? AND ?",
+        (DAY, NEXT_DAY),
+    ),
+    "energy mix": (
+        "SELECT type_name, SUM(total) FROM energy_types GROUP BY type_name",
+        (),
+    ),
+    "wind generation for a day": (
+        "SELECT strftime('%H', p.start) AS hour, SUM(e.total) FROM periods p "
+        "JOIN energy_types e ON e.period_id = p.id "
+        "WHERE e.type_name = 'Wind' AND p.start >= ? AND p.start < ? "
+        "GROUP BY hour",
+        (DAY, NEXT_DAY),
+    ),
+    "weather for a day": (
+        "SELECT time, wind_mph FROM weather WHERE time >= ? AND time < ?",
+        (DAY, NEXT_DAY),
+    ),
+}
+
+
+def _drop_indexes(engine):
+    with engine.begin() as connection:
+        for table in Base.metadata.sorted_tables:
+            for index in table.indexes:
+                connection.exec_driver_sql(f"DROP INDEX IF EXISTS {index.name}")
+
+
+def _measure(engine, repeat):
+    results = {}
+    with engine.connect() as connection:
+        for name, (sql, params) in QUERIES.items():
+            plan = [
+                row[-1]
+                for row in connection.exec_driver_sql(
+                    f"EXPLAIN QUERY PLAN {sql}", params
+                )
+            ]
+            timings = []
+            for _ in range(repeat):
+                started = time.perf_counter()
+                connection.exec_driver_sql(sql, params).fetchall()
+                timings.append(time.perf_counter() - started)
+            results[name] = (plan, statistics.median(timings))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--years", type=float, default=3)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    try:
+        before_path = os.path.join(workdir, "before.db")
+        after_path = os.path.join(workdir, "after.db")
+
+        print(f"Generating {args.years} years of synthetic data...")
+        _drop_indexes(generate_database(before_path, args.years))
+        shutil.copy(before_path, after_path)
+
+        before_engine = create_engine(f"sqlite:///{before_path}")
+        after_engine = create_engine(f"sqlite:///{after_path}")
+        migrate(after_engine)
+
+        before = _measure(before_engine, args.repeat)
+        after = _measure(after_engine, args.repeat)
+
+        for name in QUERIES:
+            plan_before, time_before = before[name]
+            plan_after, time_after = after[name]
+            print(f"\n{name}")
+            print(f"  before {time_before * 1000:9.2f} ms  {'; '.join(plan_before)}")
+            print(f"  after  {time_after * 1000:9.2f} ms  {'; '.join(plan_after)}")
+    finally:
+        shutil.rmtree(workdir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""Local stand-ins for the energy and weather APIs.
+
+Serves synthetic payloads shaped like the real responses, so the ETL can be
+benchmarked offline:
+
+    /api/today/generation           today's halfHourlyData
+    /api/historical/generation      halfHourlyData for from_date..to_date
+    /v1/forecast.json               WeatherAPI forecast for today
+    /v1/history.json?dt=YYYY-MM-DD  WeatherAPI history for a day
+
+Responses carry an ETag and honour If-None-Match. `latency` adds a fixed
+delay per request to mimic a remote server.
+"""
+
+import datetime
+import hashlib
+import itertools
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from .synthetic import HALF_HOUR, iter_periods, iter_weather_hours
+
+
+def _today():
+    now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+    return now.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def periods_between(start, end, seed=0):
+    """halfHourlyData entries for the periods starting in [start, end]."""
+    count = int((end - start).total_seconds() // HALF_HOUR.total_seconds()) + 1
+    return list(itertools.islice(iter_periods(years=1, start=start, seed=seed), count))
+
+
+def weather_day(day, seed=0):
+    """A WeatherAPI forecast/history response for the 24 hours of `day`."""
+    hours = list(
+        itertools.islice(iter_weather_hours(years=1, start=day, seed=seed), 24)
+    )
+    return {
+        "location": {"name": "London", "country": "United Kingdom"},
+        "current": {"last_updated": time.strftime("%Y-%m-%d %H:%M")},
+        "forecast": {
+            "forecastday": [{"date": day.strftime("%Y-%m-%d"), "hour": hours}]
+        },
+    }
+
+
+class StubServer:
+    """The stub APIs on an ephemeral localhost port; use as a context manager."""
+
+    def __init__(self, latency=0.0, seed=0):
+        self.latency = latency
+        self.seed = seed
+        self.requests = 0
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self._server.server_port}"
+
+    def __enter__(self):
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def payload(self, path, query):
+        if path == "/api/today/generation":
+            today = _today()
+            end = today + datetime.timedelta(days=1) - HALF_HOUR
+            return {"halfHourlyData": periods_between(today, end, self.seed)}
+        if path == "/api/historical/generation":
+            start, end = (
+                datetime.datetime.strptime(query[key][0], "%Y-%m-%dT%H:%M:%SZ")
+                for key in ("from_date", "to_date")
+            )
+            return {"halfHourlyData": periods_between(start, end, self.seed)}
+        if path == "/v1/forecast.json":
+            return weather_day(_today(), self.seed)
+        if path == "/v1/history.json":
+            day = datetime.datetime.strptime(query["dt"][0], "%Y-%m-%d")
+            return weather_day(day, self.seed)
+        return None
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                stub.requests += 1
+                if stub.latency:
+                    time.sleep(stub.latency)
+                url = urlparse(self.path)
+                payload = stub.payload(url.path, parse_qs(url.query))
+                if payload is None:
+                    self._send(404, b"")
+                    return
+                body = json.dumps(payload).encode()
+                etag = '"%s"' % hashlib.sha1(body).hexdigest()
+                if self.headers.get("If-None-Match") == etag:
+                    self._send(304, b"", etag)
+                else:
+                    self._send(200, body, etag)
+
+            def _send(self, status, body, etag=None):
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                if etag:
+                    self.send_header("ETag", etag)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
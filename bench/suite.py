@@ -0,0 +1,421 @@
+"""Benchmark suite over synthetic fixture databases.
+
+Builds (or reuses) a fixture database for each size in --years, then times
+the ETL loaders against the local stub APIs, the DataAccessLayer methods,
+get_corr and every dashboard page. Each fixture is benchmarked in its own
+process on a scratch copy, so module-level engines and caches start cold and
+the fixtures stay pristine. Results are written as JSON; with --compare the
+medians are checked against an earlier results file.
+
+python -m bench.suite --years 1 3 --repeat 5 --output bench-results.json
+python -m bench.suite --years 1 --compare bench-results.json
+"""
+
+import argparse
+import datetime
+import importlib.util
+import json
+import os
+import platform
+import shutil
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from .synthetic import generate_database
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FIXTURES_PATH = os.path.join(tempfile.gettempdir(), "energy-bench-fixtures")
+
+# Days of history the backfill scenarios load
+BACKFILL_DAYS = 14
+
+PAGES = ["/page-1", "/page-3", "/page-5", "/page-6", "/page-7"]
+
+
+def fixture(years, directory=FIXTURES_PATH):
+    """Path of the migrated fixture holding `years` of history, built once."""
+    from app.data.migrations import migrate
+
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"synthetic-{years:g}y.db")
+    if not os.path.exists(path):
+        print(f"Generating {years:g} years of synthetic data...", file=sys.stderr)
+        partial = path + ".partial"
+        engine = generate_database(partial, years)
+        migrate(engine)
+        engine.dispose()
+        os.replace(partial, path)
+    return path
+
+
+def _summary(timings):
+    ms = [timing * 1000 for timing in timings]
+    return {
+        "repeat": len(ms),
+        "first_ms": ms[0],
+        "median_ms": statistics.median(ms),
+        "min_ms": min(ms),
+        "max_ms": max(ms),
+    }
+
+
+class Runner:
+    def __init__(self, repeat):
+        self.repeat = repeat
+        self.results = {}
+
+    def time(self, name, func, setup=None, repeat=None):
+        timings = []
+        for _ in range(repeat or self.repeat):
+            if setup:
+                setup()
+            started = time.perf_counter()
+            func()
+            timings.append(time.perf_counter() - started)
+        self.results[name] = _summary(timings)
+        print(
+            f"{name:<45} {self.results[name]['median_ms']:>10.2f} ms", file=sys.stderr
+        )
+
+
+def _load_dashboard():
+    """Import app/app.py the way `python app.py` does, as a fresh module."""
+    sys.path.insert(0, os.path.join(ROOT, "app"))
+    spec = importlib.util.spec_from_file_location(
+        "dashboard", os.path.join(ROOT, "app", "app.py")
+    )
+    dashboard = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(dashboard)
+    return dashboard
+
+
+def _render(dashboard, page):
+    """Render a page and run the callbacks that draw its graphs."""
+    dashboard.render_page_content(page)
+    if page == "/page-1":
+        dashboard.update_carbon_graph(None, None)
+    elif page == "/page-3":
+        dashboard.update_energy_mix_graph(None, None)
+    elif page == "/page-5":
+        dashboard.update_weather_graphs(None, None)
+
+
+def _read_scenarios(runner, database_path):
+    from sqlalchemy.orm import Session
+
+    from app.data.dal import DataAccessLayer
+    from app.data.db import read_engine
+    from app.data.response_cache import MemoryBackend
+    from app.data.store import TimeSeriesStore
+    from app.reports import correlation
+
+    with sqlite3.connect(database_path) as conn:
+        last = datetime.datetime.fromisoformat(
+            conn.execute("SELECT max(start) FROM periods").fetchone()[0]
+        )
+    day = last.replace(hour=0, minute=0, second=0, microsecond=0)
+    month = day.replace(day=1) - datetime.timedelta(days=1)
+    month = (month.replace(day=1), day.replace(day=1))
+    week = (day - datetime.timedelta(days=7), day)
+
+    store = TimeSeriesStore()
+    with Session(read_engine) as session:
+        store.refresh(session)
+        sql_dal = DataAccessLayer(session)
+        for label, dal in (
+            ("dal", sql_dal),
+            ("dal+store", DataAccessLayer(session, store)),
+        ):
+            runner.time(
+                f"{label}.carbon_intensity.points",
+                lambda: dal.get_carbon_intensity_over_time(points=1000),
+            )
+            runner.time(
+                f"{label}.carbon_intensity.week",
+                lambda: dal.get_carbon_intensity_over_time(*week),
+            )
+            runner.time(
+                f"{label}.weather.points",
+                lambda: dal.get_weather(points=1000),
+            )
+            runner.time(
+                f"{label}.points_after.day",
+                lambda: dal.get_points_after("carbon", day),
+            )
+        dal = sql_dal
+        runner.time("dal.energy_mix.all", lambda: dal.get_energy_mix())
+        runner.time(
+            "dal.energy_mix.month",
+            lambda: dal.get_energy_mix(start=month[0], end=month[1]),
+        )
+        # Not on an hour boundary, so summed from the periods
+        runner.time(
+            "dal.energy_mix.unaligned",
+            lambda: dal.get_energy_mix(
+                start=week[0] + datetime.timedelta(minutes=30), end=week[1]
+            ),
+        )
+        runner.time("dal.weather.week", lambda: dal.get_weather(*week))
+        runner.time("dal.wind_data", lambda: dal.get_wind_data(day.date()))
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            pass
+        else:
+            runner.time(
+                "dal.read_history.month",
+                lambda: dal.read_history("periods", None, *month),
+            )
+
+    runner.time(
+        "reports.get_corr",
+        lambda: correlation.get_corr(database_path),
+        setup=correlation._cache.clear,
+    )
+    runner.time(
+        "reports.compute_corr",
+        lambda: correlation.compute_corr(database_path),
+        repeat=min(runner.repeat, 3),
+    )
+
+    dashboard = _load_dashboard()
+
+    def clear_response_cache():
+        dashboard.response_cache.backend = MemoryBackend()
+
+    for page in PAGES:
+        runner.time(
+            f"page{page}",
+            lambda: _render(dashboard, page),
+            setup=clear_response_cache,
+        )
+        runner.time(f"page{page}.cached", lambda: _render(dashboard, page))
+
+
+def _etl_scenarios(runner, database_path, stub):
+    from app.data.db import engine
+    from app.etl import energy, weather
+    from app.etl.cache import HttpCache
+    from app.etl.historic import energy as historic_energy
+    from app.etl.historic import weather as historic_weather
+
+    with sqlite3.connect(database_path) as conn:
+        history_end = conn.execute("SELECT max(start) FROM periods").fetchone()[0]
+
+    def reset():
+        """Remove everything the stub loaded, so each repeat loads it again."""
+        with engine.begin() as connection:
+            stubbed = "SELECT id FROM periods WHERE start > ?"
+            for table in ("energy_types", "generations", "period_generation"):
+                connection.exec_driver_sql(
+                    f"DELETE FROM {table} WHERE period_id IN ({stubbed})",
+                    (history_end,),
+                )
+            connection.exec_driver_sql(
+                "DELETE FROM periods WHERE start > ?", (history_end,)
+            )
+            connection.exec_driver_sql(
+                "DELETE FROM weather WHERE time > ?", (history_end,)
+            )
+            for table in ("backfill_checkpoints", "high_water_marks"):
+                connection.exec_driver_sql(f"DELETE FROM {table}")
+
+    today = stub.payload("/api/today/generation", {})["halfHourlyData"]
+    runner.time(
+        "etl.energy.load",
+        lambda: energy.load(energy.transform(today)),
+        setup=reset,
+    )
+
+    cache_path = tempfile.mkdtemp()
+    try:
+        cache = HttpCache(cache_path)
+        url = stub.url + "/api/today/generation"
+        # The first run loads the day; the rest are unchanged polls
+        reset()
+        runner.time("etl.energy.run.poll", lambda: energy.run(url=url, cache=cache))
+        forecast_url = stub.url + "/v1/forecast.json"
+        runner.time(
+            "etl.weather.run",
+            lambda: weather.run(base_url=forecast_url, cache=HttpCache(cache_path)),
+            setup=lambda: shutil.rmtree(cache_path, ignore_errors=True),
+        )
+    finally:
+        shutil.rmtree(cache_path, ignore_errors=True)
+
+    energy_url = stub.url + "/api/historical/generation"
+    weather_url = stub.url + "/v1/history.json"
+    repeat = min(runner.repeat, 3)
+    runner.time(
+        "etl.historic_energy.backfill",
+        lambda: historic_energy.backfill(
+            BACKFILL_DAYS, group_by="30m", base_url=energy_url
+        ),
+        setup=reset,
+        repeat=repeat,
+    )
+    runner.time(
+        "etl.historic_energy.pipelined",
+        lambda: historic_energy.backfill_pipelined(
+            BACKFILL_DAYS, group_by="30m", base_url=energy_url
+        ),
+        setup=reset,
+        repeat=repeat,
+    )
+    runner.time(
+        "etl.historic_weather.run",
+        lambda: historic_weather.run(BACKFILL_DAYS, rate=None, base_url=weather_url),
+        setup=reset,
+        repeat=repeat,
+    )
+    runner.time(
+        "etl.historic_weather.pipelined",
+        lambda: historic_weather.run(
+            BACKFILL_DAYS, pipelined=True, rate=None, base_url=weather_url
+        ),
+        setup=reset,
+        repeat=repeat,
+    )
+
+
+def child(database_path, output, repeat, latency):
+    """Run every scenario against DATABASE_PATH and write the results.
+
+    The scratch copy is migrated first, so fixtures cached by an older
+    schema are benchmarked with the current tables filled in.
+    """
+    from app.data.migrations import migrate
+    from .stub import StubServer
+
+    migrate()
+    runner = Runner(repeat)
+    _read_scenarios(runner, database_path)
+    with StubServer(latency=latency) as stub:
+        _etl_scenarios(runner, database_path, stub)
+    with open(output, "w") as f:
+        json.dump(runner.results, f)
+
+
+def _run_fixture(path, repeat, latency):
+    workdir = tempfile.mkdtemp()
+    try:
+        database_path = os.path.join(workdir, "data.db")
+        shutil.copy(path, database_path)
+        output = os.path.join(workdir, "results.json")
+        env = dict(
+            os.environ,
+            DATABASE_PATH=database_path,
+            HTTP_CACHE_PATH=os.path.join(workdir, "http"),
+            ARCHIVE_PATH=os.path.join(workdir, "archive"),
+        )
+        env.pop("RESPONSE_CACHE_PATH", None)
+        subprocess.run(
+            [
+                sys.executable,
+                "-m",
+                "bench.suite",
+                "--child",
+                database_path,
+                output,
+                "--repeat",
+                str(repeat),
+                "--latency",
+                str(latency),
+            ],
+            cwd=workdir,
+            env=dict(
+                env, PYTHONPATH=os.pathsep.join([ROOT, env.get("PYTHONPATH", "")])
+            ),
+            stdout=subprocess.DEVNULL,
+            check=True,
+        )
+        with open(output) as f:
+            return json.load(f)
+    finally:
+        shutil.rmtree(workdir)
+
+
+def _meta(args):
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=ROOT,
+            capture_output=True,
+            text=True,
+        ).stdout.strip()
+    except OSError:
+        commit = None
+    return {
+        "created_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "commit": commit,
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "platform": platform.platform(),
+        "repeat": args.repeat,
+        "latency": args.latency,
+    }
+
+
+def compare(results, baseline, threshold):
+    """Print each median against the baseline; return the regressions."""
+    regressions = []
+    for size, scenarios in results.items():
+        for name, result in scenarios.items():
+            before = baseline.get(size, {}).get(name)
+            if before is None:
+                continue
+            ratio = result["median_ms"] / before["median_ms"]
+            flag = ""
+            if ratio > threshold:
+                flag = "  REGRESSION"
+                regressions.append((size, name, ratio))
+            print(
+                f"{size:>6} {name:<45} {before['median_ms']:>10.2f} -> "
+                f"{result['median_ms']:>10.2f} ms  x{ratio:.2f}{flag}"
+            )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--years", type=float, nargs="+", default=[1, 3])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="seconds of stub API delay"
+    )
+    parser.add_argument("--fixtures", default=FIXTURES_PATH)
+    parser.add_argument("--output", default="bench-results.json")
+    parser.add_argument("--compare", help="earlier results file to compare against")
+    parser.add_argument(
+        "--threshold", type=float, default=1.2, help="slowdown ratio to flag"
+    )
+    parser.add_argument("--child", nargs=2, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        child(*args.child, args.repeat, args.latency)
+        return
+
+    results = {}
+    for years in args.years:
+        path = fixture(years, args.fixtures)
+        print(f"Benchmarking {os.path.basename(path)}", file=sys.stderr)
+        results[f"{years:g}y"] = _run_fixture(path, args.repeat, args.latency)
+
+    with open(args.output, "w") as f:
+        json.dump({"meta": _meta(args), "results": results}, f, indent=2)
+    print(f"Results written to {args.output}", file=sys.stderr)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["results"]
+        if compare(results, baseline, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
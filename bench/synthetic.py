@@ -0,0 +1,206 @@
+"""Synthetic multi-year data for the benchmarks.
+
+Values follow daily and seasonal cycles with noise, and wind generation
+tracks the generated wind speed so the correlation reports have something
+to find.
+"""
+
+import datetime
+import math
+import random
+
+from sqlalchemy import create_engine
+
+from app.data.db import Base
+from app.data import models  # noqa: F401
+
+FUELS = [
+    "Biomass",
+    "Coal",
+    "Gas",
+    "Hydro",
+    "Imports",
+    "Misc",
+    "Nuclear",
+    "PSH",
+    "Solar",
+    "Wind",
+]
+
+START = datetime.datetime(2020, 1, 1)
+HALF_HOUR = datetime.timedelta(minutes=30)
+
+# SQLAlchemy's SQLite DateTime storage format
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S.%f"
+
+
+def _wind_speed(rng, when):
+    season = math.cos(2 * math.pi * when.timetuple().tm_yday / 365.0)
+    return max(0.0, 12 + 6 * season + rng.gauss(0, 4))
+
+
+def _temperature(rng, when):
+    season = -math.cos(2 * math.pi * when.timetuple().tm_yday / 365.0)
+    daily = -math.cos(2 * math.pi * (when.hour - 3) / 24.0)
+    return 11 + 7 * season + 4 * daily + rng.gauss(0, 1.5)
+
+
+def _solar(when):
+    return max(0.0, math.sin(math.pi * (when.hour + when.minute / 60 - 6) / 12.0))
+
+
+def iter_periods(years=1, start=START, seed=0):
+    """Yield half-hourly entries shaped like the API's halfHourlyData."""
+    rng = random.Random(seed)
+    count = int(years * 365 * 48)
+    for i in range(count):
+        when = start + i * HALF_HOUR
+        wind = _wind_speed(rng, when)
+        values = {
+            "Biomass": 1800 + rng.gauss(0, 100),
+            "Coal": max(0.0, rng.gauss(300, 150)),
+            "Gas": max(0.0, 12000 - 400 * wind + rng.gauss(0, 1000)),
+            "Hydro": 300 + rng.gauss(0, 50),
+            "Imports": 4000 + rng.gauss(0, 500),
+            "Misc": 100 + rng.gauss(0, 20),
+            "Nuclear": 4500 + rng.gauss(0, 100),
+            "PSH": max(0.0, rng.gauss(400, 200)),
+            "Solar": 9000 * _solar(when) * rng.uniform(0.3, 1.0),
+            "Wind": max(0.0, 550 * wind + rng.gauss(0, 800)),
+        }
+        total = sum(values.values())
+        yield {
+            "start": when.isoformat() + "Z",
+            "end": (when + HALF_HOUR).isoformat() + "Z",
+            "carbonIntensity": round(40 + 0.012 * values["Gas"] + rng.gauss(0, 5)),
+            "settlementPeriod": (when.hour * 60 + when.minute) // 30 + 1,
+            "generationTotal": total,
+            "generationValues": {
+                fuel: {"total": value, "percentage": 100 * value / total}
+                for fuel, value in values.items()
+            },
+        }
+
+
+def iter_weather_hours(years=1, start=START, seed=0):
+    """Yield hourly entries shaped like WeatherAPI's forecastday.hour."""
+    rng = random.Random(seed + 1)
+    count = int(years * 365 * 24)
+    for i in range(count):
+        when = start + datetime.timedelta(hours=i)
+        temp_c = _temperature(rng, when)
+        wind_mph = _wind_speed(rng, when)
+        precip_mm = max(0.0, rng.gauss(-0.5, 1.0))
+        yield {
+            "time_epoch": int(when.replace(tzinfo=datetime.timezone.utc).timestamp()),
+            "time": when.strftime("%Y-%m-%d %H:%M"),
+            "temp_c": round(temp_c, 1),
+            "temp_f": round(temp_c * 9 / 5 + 32, 1),
+            "is_day": int(6 <= when.hour < 18),
+            "condition": {
+                "text": "Light rain" if precip_mm else "Partly cloudy",
+                "icon": "//cdn.weatherapi.com/weather/64x64/day/116.png",
+                "code": 1183 if precip_mm else 1003,
+            },
+            "wind_mph": round(wind_mph, 1),
+            "wind_kph": round(wind_mph * 1.609, 1),
+            "wind_degree": rng.randrange(360),
+            "wind_dir": rng.choice(["N", "NE", "E", "SE", "S", "SW", "W", "NW"]),
+            "pressure_mb": round(1013 + rng.gauss(0, 10)),
+            "pressure_in": 29.9,
+            "precip_mm": round(precip_mm, 2),
+            "precip_in": round(precip_mm / 25.4, 2),
+            "humidity": rng.randrange(40, 100),
+            "cloud": rng.randrange(0, 101),
+            "feelslike_c": round(temp_c - 2, 1),
+            "feelslike_f": round((temp_c - 2) * 9 / 5 + 32, 1),
+            "windchill_c": round(temp_c - 2, 1),
+            "windchill_f": round((temp_c - 2) * 9 / 5 + 32, 1),
+            "heatindex_c": round(temp_c, 1),
+            "heatindex_f": round(temp_c * 9 / 5 + 32, 1),
+            "dewpoint_c": round(temp_c - 4, 1),
+            "dewpoint_f": round((temp_c - 4) * 9 / 5 + 32, 1),
+            "will_it_rain": int(precip_mm > 0),
+            "chance_of_rain": 80 if precip_mm else 10,
+            "will_it_snow": 0,
+            "chance_of_snow": 0,
+            "vis_km": 10.0,
+            "vis_miles": 6.0,
+            "gust_mph": round(wind_mph * 1.4, 1),
+            "gust_kph": round(wind_mph * 2.25, 1),
+            "uv": float(max(0, round(6 * _solar(when)))),
+        }
+
+
+def _stamp(value):
+    parsed = datetime.datetime.fromisoformat(value.rstrip("Z"))
+    return parsed.strftime(TIME_FORMAT)
+
+
+def generate_database(path, years=1, start=START, seed=0):
+    """Create a database at `path` holding `years` of synthetic history.
+
+    Rows are written with raw executemany so building a multi-year fixture
+    takes seconds. Returns the engine bound to the new database.
+    """
+    engine = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(engine)
+
+    periods, generations, energy_types = [], [], []
+    for period_id, entry in enumerate(iter_periods(years, start, seed), 1):
+        periods.append(
+            (
+                period_id,
+                _stamp(entry["start"]),
+                _stamp(entry["end"]),
+                entry["carbonIntensity"],
+                entry["settlementPeriod"],
+            )
+        )
+        generations.append((period_id, period_id, entry["generationTotal"]))
+        energy_types.extend(
+            (period_id, fuel, values["total"], values["percentage"])
+            for fuel, values in entry["generationValues"].items()
+        )
+
+    weather = [
+        (
+            hour["time_epoch"],
+            datetime.datetime.strptime(hour["time"], "%Y-%m-%d %H:%M").strftime(
+                TIME_FORMAT
+            ),
+            hour["temp_c"],
+            hour["wind_mph"],
+            hour["wind_dir"],
+            hour["pressure_mb"],
+            hour["precip_mm"],
+            hour["humidity"],
+            hour["cloud"],
+            hour["gust_mph"],
+            hour["uv"],
+        )
+        for hour in iter_weather_hours(years, start, seed)
+    ]
+
+    with engine.begin() as connection:
+        connection.exec_driver_sql(
+            'INSERT INTO periods (id, start, "end", carbon_intensity, '
+            "settlement_period) VALUES (?, ?, ?, ?, ?)",
+            periods,
+        )
+        connection.exec_driver_sql(
+            "INSERT INTO generations (id, period_id, total) VALUES (?, ?, ?)",
+            generations,
+        )
+        connection.exec_driver_sql(
+            "INSERT INTO energy_types (period_id, type_name, total, percentage) "
+            "VALUES (?, ?, ?, ?)",
+            energy_types,
+        )
+        connection.exec_driver_sql(
+            "INSERT INTO weather (time_epoch, time, temp_c, wind_mph, wind_dir, "
+            "pressure_mb, precip_mm, humidity, cloud, gust_mph, uv) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            weather,
+        )
+    return engine
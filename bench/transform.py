@@ -0,0 +1,38 @@
+"""Compare the ORM and columnar transform paths.
+
+Transforms synthetic energy payloads of increasing size both ways and
+prints the time per payload.
+
+python -m bench.transform --sizes 48 480 4800 48000
+"""
+
+import argparse
+import itertools
+import time
+
+from app.etl.columnar import transform_energy
+from app.etl.energy import _to_rows, transform
+from .synthetic import iter_periods
+
+
+def _time(func, payload):
+    started = time.perf_counter()
+    func(payload)
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[48, 480, 4800, 48000])
+    args = parser.parse_args()
+
+    print(f"{'entries':>8} {'orm ms':>10} {'columnar ms':>12}")
+    for size in args.sizes:
+        periods = list(itertools.islice(iter_periods(years=10), size))
+        orm_time = _time(lambda p: _to_rows(transform(p)), periods)
+        columnar_time = _time(transform_energy, periods)
+        print(f"{size:>8} {orm_time * 1000:>10.1f} {columnar_time * 1000:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""Regression benchmark for DataAccessLayer.get_wind_data.
+
+Times the original strftime-filtered query against the range-based one on
+databases holding increasing amounts of history. The range query should
+stay flat as history grows.
+
+python -m bench.wind --years 1 2 4
+"""
+
+import argparse
+import datetime
+import os
+import shutil
+import statistics
+import tempfile
+import time
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from app.data.dal import DataAccessLayer
+from app.data.migrations import migrate
+from app.data.models import EnergyType, Period, Weather
+from .synthetic import START, generate_database
+
+
+def strftime_wind_data(session, date):
+    """The pre-rewrite query, pinned to `date` instead of current_date."""
+    day = date.strftime("%Y-%m-%d")
+    wind_speed = (
+        session.query(
+            func.strftime("%H", Weather.time).label("hour"),
+            func.avg(Weather.wind_mph).label("wind_speed"),
+        )
+        .filter(func.strftime("%Y-%m-%d", Weather.time) == day)
+        .filter(func.strftime("%H:%M:%S", Weather.time) <= "14:00:00")
+        .group_by("hour")
+    ).subquery()
+    wind_generation = (
+        session.query(
+            func.strftime("%H", Period.start).label("hour"),
+            func.sum(EnergyType.total).label("wind_generation"),
+        )
+        .join(EnergyType)
+        .filter(EnergyType.type_name == "Wind")
+        .filter(func.strftime("%Y-%m-%d", Period.start) == day)
+        .group_by("hour")
+    ).subquery()
+    return (
+        session.query(
+            wind_speed.c.hour,
+            wind_speed.c.wind_speed,
+            wind_generation.c.wind_generation,
+        )
+        .join(wind_generation, wind_speed.c.hour == wind_generation.c.hour)
+        .all()
+    )
+
+
+def _median(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--years", type=float, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    try:
+        print(f"{'years':>6} {'strftime ms':>12} {'range ms':>10}")
+        for years in args.years:
+            path = os.path.join(workdir, f"wind-{years}.db")
+            engine = generate_database(path, years)
+            migrate(engine)
+            # the last full day of synthetic history
+            date = (START + datetime.timedelta(days=int(years * 365) - 1)).date()
+
+            with Session(engine) as session:
+                dal = DataAccessLayer(session)
+                before, expected = _median(
+                    lambda: strftime_wind_data(session, date), args.repeat
+                )
+                after, result = _median(lambda: dal.get_wind_data(date), args.repeat)
+            assert [tuple(row) for row in result] == [
+                tuple(row) for row in expected
+            ], "range query disagrees with the strftime query"
+            print(f"{years:>6} {before * 1000:>12.2f} {after * 1000:>10.2f}")
+            engine.dispose()
+    finally:
+        shutil.rmtree(workdir)
+
+
+if __name__ == "__main__":
+    main()
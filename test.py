@@ -1,17 +1,5 @@
-from app.etl.energy import run
-from app.etl.weather import run as run_weather
+from app.etl.scheduler import main
 
-from app.etl.historic.energy import run as run_historic
-from app.etl.historic.weather import run as run_historic_weather
-
-from app.data.db import Base, engine
-
-Base.metadata.create_all(engine)
-
-run_historic_weather()
-
-run_historic()
-
-run()
-
-run_weather()
+# Runs the energy and forecast weather jobs on their own cadence; pass
+# --backfill to load the historic energy and weather data first.
+main()